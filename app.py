@@ -2,13 +2,22 @@
 Granada v2 - Main Application Entry Point
 Offline Arabic Book Search Engine and Personal Library Manager
 """
+import multiprocessing
 import sys
 import webbrowser
-import threading
 from app import create_app
 from config import Config
 
-app = create_app()
+if __name__ == '__main__':
+    # Folder uploads parse books in worker processes and the native file
+    # dialogs run in one; in the frozen build those are started through
+    # this executable and must be handed over before the app is created
+    multiprocessing.freeze_support()
+
+# Spawned worker processes import this module as __mp_main__ and only need
+# the parser, not a second app instance
+if __name__ != '__mp_main__':
+    app = create_app()
 
 
 def open_browser():
@@ -22,19 +31,30 @@ if __name__ == '__main__':
     is_frozen = getattr(sys, 'frozen', False)
 
     if is_frozen:
-        # Production mode - open browser after short delay
-        threading.Timer(1.5, open_browser).start()
+        # Production mode - bind the listening socket first, then open the
+        # browser once the server can actually accept the connection
+        try:
+            # Production WSGI server with a fixed worker thread pool
+            from waitress import create_server
+        except ImportError:
+            # Fall back to the Werkzeug server if waitress is not bundled
+            from werkzeug.serving import make_server
+            server = make_server(Config.HOST, Config.PORT, app, threaded=True)
+            serve_forever = server.serve_forever
+        else:
+            server = create_server(
+                app,
+                host=Config.HOST,
+                port=Config.PORT,
+                threads=8,
+                connection_limit=256
+            )
+            serve_forever = server.run
+
         print(f"Starting Granada at http://{Config.HOST}:{Config.PORT}")
         print("Press Ctrl+C to stop the server.")
-
-        # Run without debug, with threading for better performance
-        app.run(
-            host=Config.HOST,
-            port=Config.PORT,
-            debug=False,
-            threaded=True,
-            use_reloader=False
-        )
+        open_browser()
+        serve_forever()
     else:
         # Development mode
         app.run(
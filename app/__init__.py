@@ -2,35 +2,122 @@
 Granada v2 Flask Application Factory
 """
 import os
+import threading
+
+import orjson
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
 
 from config import config, DATA_DIR, RESOURCE_DIR
 
-
-def migrate_database(db_path):
-    """Run database migrations to add new columns."""
+# Zero-byte marker in DATA_DIR written once the bundled books are imported
+BUNDLED_SENTINEL = '.bundled_imported'
+
+# File extensions picked up from the bundled_books directory
+BUNDLED_BOOK_EXTENSIONS = ('.mARkdown', '.md', '.txt')
+
+# Old sample data IDs that conflict with OpenITI downloads
+_SAMPLE_BOOK_IDS = ('sahih_bukhari', 'sahih_muslim', 'sunan_abi_dawud')
+_SAMPLE_AUTHOR_IDS = ('bukhari', 'muslim', 'abu_dawud', 'tirmidhi', 'nasai')
+
+# Settings flag marking the schema version the planner statistics cover;
+# bump it whenever indexes are added so ANALYZE runs once more
+ANALYZED_SETTING = 'schema_analyzed_v5'
+
+# Finished upload_status rows are only polled right after the job ends;
+# older ones are dropped at startup
+UPLOAD_STATUS_KEEP_DAYS = 1
+
+# Tables whose saved statistics are checked against their size at startup;
+# once one has grown by STATS_GROWTH_FACTOR they are gathered again, reading
+# at most STATS_ANALYSIS_LIMIT rows per index so the refresh stays cheap
+STATS_TABLES = ('books', 'pages')
+STATS_GROWTH_FACTOR = 2
+STATS_ANALYSIS_LIMIT = 400
+
+# (table, book id column) pairs swept by cleanup_sample_data
+_CLEANUP_TABLES = (
+    ('pages', 'book_id'),
+    ('reading_progress', 'book_id'),
+    ('collection_books', 'book_id'),
+    ('book_custom_categories', 'book_id'),
+    ('books', 'id'),
+)
+
+_CLEANUP_BOOK_SQL = tuple(
+    f"DELETE FROM {table} WHERE {column} IN ({','.join('?' * len(_SAMPLE_BOOK_IDS))})"
+    for table, column in _CLEANUP_TABLES
+)
+
+_CLEANUP_AUTHORS_SQL = f'''
+    DELETE FROM authors
+    WHERE id IN ({','.join('?' * len(_SAMPLE_AUTHOR_IDS))})
+      AND id NOT IN (SELECT author_id FROM books WHERE author_id IS NOT NULL)
+'''
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider that encodes with orjson instead of the stdlib encoder.
+
+    Output is compact UTF-8 in insertion order, debug mode included; a
+    caller can still pass sort_keys or indent to dumps() explicitly. Types
+    orjson doesn't know fall back to Flask's default.
+    """
+
+    # Skip the per-response key sort and debug-mode pretty-printing
+    sort_keys = False
+    compact = True
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def _open_db(db_path):
+    """
+    Open a SQLite connection tuned for the startup write path.
+
+    WAL with synchronous=NORMAL avoids the rollback-journal fsyncs on every
+    commit and lets readers proceed while migrations/imports are writing.
+    """
     import sqlite3
     conn = sqlite3.connect(db_path, timeout=30)
+    if db_path != ':memory:':
+        # WAL and mmap only apply to file-backed databases
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA busy_timeout=30000')
+    return conn
+
+
+def migrate_database(conn):
+    """Run database migrations to add new columns."""
+    import sqlite3
     cursor = conn.cursor()
 
-    # Get existing columns in pages table
+    # Get existing columns for both tables up front
     cursor.execute("PRAGMA table_info(pages)")
     page_columns = {row[1] for row in cursor.fetchall()}
-
-    # Add volume column if missing
-    if 'volume' not in page_columns:
-        cursor.execute('ALTER TABLE pages ADD COLUMN volume INTEGER DEFAULT 1')
-        print("Added 'volume' column to pages table")
-
-    # Add original_page column if missing
-    if 'original_page' not in page_columns:
-        cursor.execute('ALTER TABLE pages ADD COLUMN original_page INTEGER')
-        print("Added 'original_page' column to pages table")
-
-    # Get existing columns in books table
     cursor.execute("PRAGMA table_info(books)")
     book_columns = {row[1] for row in cursor.fetchall()}
 
+    # Page columns to add if missing
+    page_columns_to_add = [
+        ('volume', 'INTEGER DEFAULT 1'),
+        ('original_page', 'INTEGER'),
+    ]
+
     # All metadata columns to add if missing
     book_columns_to_add = [
         ('volumes_count', 'INTEGER DEFAULT 1'),
@@ -52,10 +139,19 @@ def migrate_database(db_path):
         ('openiti_uri', 'TEXT'),
     ]
 
-    for col_name, col_type in book_columns_to_add:
-        if col_name not in book_columns:
-            cursor.execute(f'ALTER TABLE books ADD COLUMN {col_name} {col_type}')
-            print(f"Added '{col_name}' column to books table")
+    # Plan the ALTERs first; an already-migrated database needs none
+    missing = [('pages', name, col_type) for name, col_type in page_columns_to_add
+               if name not in page_columns]
+    missing += [('books', name, col_type) for name, col_type in book_columns_to_add
+                if name not in book_columns]
+
+    if missing:
+        # DDL autocommits by default; group all ALTERs into one transaction
+        cursor.execute('BEGIN')
+        for table, col_name, col_type in missing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col_name} {col_type}')
+            print(f"Added '{col_name}' column to {table} table")
+        conn.commit()
 
     # Create index if it doesn't exist
     try:
@@ -63,35 +159,45 @@ def migrate_database(db_path):
     except sqlite3.OperationalError:
         pass  # Index already exists
 
+    # idx_pages_book_page serves every book_id lookup (including COUNT and
+    # MAX), so the old single-column index only slowed page inserts down
+    cursor.execute('DROP INDEX IF EXISTS idx_pages_book')
+    # Likewise idx_toc_book_pos (book_id, position) replaces idx_toc_book
+    cursor.execute('DROP INDEX IF EXISTS idx_toc_book')
+
     conn.commit()
-    conn.close()
+
+    # Move a standalone pages_fts to the external-content layout
+    from app.models import migrate_pages_fts
+    migrate_pages_fts(conn)
 
 
-def import_bundled_books(db_path):
+def import_bundled_books(conn, db_path):
     """Import bundled starter books on first run."""
-    import sqlite3
-    from pathlib import Path
+    # Sentinel file lets warm starts skip the directory scan and the query
+    sentinel_path = os.path.join(DATA_DIR, BUNDLED_SENTINEL)
+    if os.path.exists(sentinel_path):
+        return
 
     # Check for bundled_books directory
     bundled_dir = os.path.join(RESOURCE_DIR, 'bundled_books')
     if not os.path.exists(bundled_dir):
         return
 
-    # Get list of book files
-    book_files = [f for f in os.listdir(bundled_dir)
-                  if f.endswith('.mARkdown') or f.endswith('.md') or f.endswith('.txt')]
+    # Get list of book files (DirEntry caches is_file() and the joined path)
+    with os.scandir(bundled_dir) as entries:
+        book_files = [e for e in entries
+                      if e.is_file() and e.name.endswith(BUNDLED_BOOK_EXTENSIONS)]
 
     if not book_files:
         return
 
-    # Check if we've already imported bundled books
-    conn = sqlite3.connect(db_path, timeout=30)
     cursor = conn.cursor()
     cursor.execute("SELECT value FROM settings WHERE key = 'bundled_books_imported'")
     row = cursor.fetchone()
-    conn.close()
-
     if row and row[0] == 'true':
+        # Imported before the sentinel existed; write it for next time
+        open(sentinel_path, 'w').close()
         return  # Already imported
 
     print(f"Importing {len(book_files)} bundled books...")
@@ -101,10 +207,10 @@ def import_bundled_books(db_path):
     uploader = BookUploader(db_path)
 
     imported_count = 0
-    for book_file in book_files:
-        file_path = os.path.join(bundled_dir, book_file)
+    for entry in book_files:
+        book_file = entry.name
         try:
-            result = uploader.upload_file(file_path, category_id=1)
+            result = uploader.upload_file(entry.path, category_id=1)
             if result.get('status') == 'success':
                 imported_count += 1
                 print(f"  Imported: {result.get('book', {}).get('title', book_file)}")
@@ -113,45 +219,149 @@ def import_bundled_books(db_path):
         except Exception as e:
             print(f"  Error importing {book_file}: {e}")
 
-    # Mark as imported
-    conn = sqlite3.connect(db_path, timeout=30)
-    cursor = conn.cursor()
+    # Only mark the import done once the loop has finished. This runs on a
+    # daemon thread, so an app closed mid-import leaves the flag unset and
+    # the next start imports again; books that made it in the first time
+    # come back as duplicates and are skipped (each book is one transaction,
+    # and the same holds if two processes such as the dev reloader race).
     cursor.execute('''
         INSERT OR REPLACE INTO settings (key, value) VALUES ('bundled_books_imported', 'true')
     ''')
     conn.commit()
-    conn.close()
+    open(sentinel_path, 'w').close()
 
     print(f"Imported {imported_count} bundled books.")
 
 
-def cleanup_sample_data(db_path):
+def cleanup_sample_data(conn):
     """Remove old sample data entries that conflict with OpenITI downloads."""
-    import sqlite3
-    conn = sqlite3.connect(db_path, timeout=30)
     cursor = conn.cursor()
 
-    # Sample data IDs that should be removed (they conflict with OpenITI IDs)
-    sample_book_ids = ['sahih_bukhari', 'sahih_muslim', 'sunan_abi_dawud']
-    sample_author_ids = ['bukhari', 'muslim', 'abu_dawud', 'tirmidhi', 'nasai']
+    # The sample rows only ever need removing once
+    cursor.execute("SELECT value FROM settings WHERE key = 'sample_data_cleaned'")
+    row = cursor.fetchone()
+    if row and row[0] == 'true':
+        return
 
-    # Remove sample books and their related data
-    for book_id in sample_book_ids:
-        cursor.execute('DELETE FROM pages WHERE book_id = ?', (book_id,))
-        cursor.execute('DELETE FROM pages_fts WHERE book_id = ?', (book_id,))
-        cursor.execute('DELETE FROM reading_progress WHERE book_id = ?', (book_id,))
-        cursor.execute('DELETE FROM collection_books WHERE book_id = ?', (book_id,))
-        cursor.execute('DELETE FROM book_custom_categories WHERE book_id = ?', (book_id,))
-        cursor.execute('DELETE FROM books WHERE id = ?', (book_id,))
+    # Run the whole sweep in one write transaction (single commit/fsync)
+    cursor.execute('BEGIN IMMEDIATE')
+
+    # Remove sample books and their related data (one set-based DELETE per table)
+    for sql in _CLEANUP_BOOK_SQL:
+        cursor.execute(sql, _SAMPLE_BOOK_IDS)
 
     # Remove sample authors (only if they have no books left)
-    for author_id in sample_author_ids:
-        cursor.execute('SELECT COUNT(*) FROM books WHERE author_id = ?', (author_id,))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('DELETE FROM authors WHERE id = ?', (author_id,))
+    cursor.execute(_CLEANUP_AUTHORS_SQL, _SAMPLE_AUTHOR_IDS)
+
+    cursor.execute('''
+        INSERT OR REPLACE INTO settings (key, value) VALUES ('sample_data_cleaned', 'true')
+    ''')
+
+    conn.commit()
+
 
+def cleanup_upload_status(conn):
+    """
+    Settle upload jobs left over from the previous run.
+
+    The upload queue lives in memory, so jobs still queued or running when
+    the app exited will never finish; they are marked done with an error
+    so a poll gets an answer. Finished jobs past UPLOAD_STATUS_KEEP_DAYS
+    are deleted, since each row holds the full (folder) result JSON.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE upload_status
+        SET state = 'done',
+            result = json_object('status', 'error', 'message', 'توقف الرفع قبل اكتماله'),
+            updated_at = datetime('now')
+        WHERE state IN ('queued', 'running')
+    ''')
+    cursor.execute('''
+        DELETE FROM upload_status
+        WHERE state = 'done' AND updated_at < datetime('now', ?)
+    ''', (f'-{UPLOAD_STATUS_KEEP_DAYS} days',))
     conn.commit()
-    conn.close()
+
+
+def _statistics_outgrown(cursor):
+    """True if a STATS_TABLES table has grown well past its sqlite_stat1 row count."""
+    # The first number of each stat is the row count ANALYZE saw; MAX(rowid)
+    # is a cheap upper bound on the current count
+    cursor.execute(f'''
+        SELECT tbl, MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1
+        WHERE tbl IN ({','.join('?' * len(STATS_TABLES))})
+        GROUP BY tbl
+    ''', STATS_TABLES)
+    analyzed_rows = dict(cursor.fetchall())
+
+    for table in STATS_TABLES:
+        cursor.execute(f'SELECT MAX(rowid) FROM {table}')
+        rows = cursor.fetchone()[0] or 0
+        if rows > STATS_GROWTH_FACTOR * max(analyzed_rows.get(table, 0), 1):
+            return True
+    return False
+
+
+def analyze_database(conn):
+    """
+    Collect planner statistics (sqlite_stat1) once the library has content.
+
+    Runs a full ANALYZE once per schema version, tracked by a settings flag,
+    so page lookups on (book_id, volume, original_page) and friends are
+    planned with real index selectivity rather than default heuristics. On
+    later starts the statistics are gathered again (with a row limit) once
+    books or pages have outgrown them; PRAGMA optimize alone would not do
+    it, since it only looks at tables this connection has queried.
+    """
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT value FROM settings WHERE key = ?", (ANALYZED_SETTING,))
+    row = cursor.fetchone()
+    if row and row[0] == 'true':
+        if _statistics_outgrown(cursor):
+            cursor.execute(f'PRAGMA analysis_limit={STATS_ANALYSIS_LIMIT}')
+            cursor.execute('ANALYZE')
+            conn.commit()
+        else:
+            cursor.execute('PRAGMA optimize')
+        return
+
+    # Statistics gathered on empty tables are useless; wait for some pages
+    cursor.execute('SELECT 1 FROM pages LIMIT 1')
+    if not cursor.fetchone():
+        return
+
+    cursor.execute('ANALYZE')
+    cursor.execute("DELETE FROM settings WHERE key LIKE 'schema_analyzed_v%'")
+    cursor.execute('''
+        INSERT INTO settings (key, value) VALUES (?, 'true')
+    ''', (ANALYZED_SETTING,))
+    conn.commit()
+
+
+def _run_startup_tasks(db_path, done_event):
+    """Run the post-schema startup tasks on one shared connection."""
+    try:
+        conn = _open_db(db_path)
+        try:
+            # Run migrations for new columns
+            migrate_database(conn)
+            # Clean up old sample data that creates duplicates
+            cleanup_sample_data(conn)
+            # Fail uploads cut off by the last exit, drop old results
+            cleanup_upload_status(conn)
+            # Import bundled books on first run
+            import_bundled_books(conn, db_path)
+            # Refresh planner statistics after migrations and imports
+            analyze_database(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Startup tasks failed: {e}")
+    finally:
+        # Never leave API requests waiting on a failed startup
+        done_event.set()
 
 
 def create_app(config_name=None):
@@ -165,6 +375,7 @@ def create_app(config_name=None):
     app = Flask(__name__,
                 static_folder=config_class.STATIC_FOLDER,
                 template_folder=config_class.TEMPLATES_FOLDER)
+    app.json = OrjsonProvider(app)
 
     # Load configuration
     app.config.from_object(config_class)
@@ -172,16 +383,32 @@ def create_app(config_name=None):
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
 
-    # Initialize database
+    # Initialize database schema (required before any route can run)
     from app.models import init_db
+    db_path = app.config['DATABASE_PATH']
+
+    # A new database must get the bundled books again; drop a stale sentinel
+    if not os.path.exists(db_path):
+        sentinel_path = os.path.join(DATA_DIR, BUNDLED_SENTINEL)
+        if os.path.exists(sentinel_path):
+            os.remove(sentinel_path)
+
     with app.app_context():
-        init_db(app.config['DATABASE_PATH'])
-        # Run migrations for new columns
-        migrate_database(app.config['DATABASE_PATH'])
-        # Clean up old sample data that creates duplicates
-        cleanup_sample_data(app.config['DATABASE_PATH'])
-        # Import bundled books on first run
-        import_bundled_books(app.config['DATABASE_PATH'])
+        init_db(db_path)
+
+    # Migrations, cleanup and the bundled-book import run in the background
+    # so the server can start accepting connections immediately. API routes
+    # wait on this event before touching the database.
+    startup_done = threading.Event()
+    app.extensions['granada_startup'] = startup_done
+    # Bumped by API write requests to invalidate the cached /filters response
+    app.config['FILTERS_EPOCH'] = 0
+    threading.Thread(
+        target=_run_startup_tasks,
+        args=(db_path, startup_done),
+        name='granada-startup',
+        daemon=True
+    ).start()
 
     # Register blueprints
     from app.routes.main import main_bp
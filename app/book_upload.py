@@ -2,15 +2,157 @@
 Granada v2 Book Upload System
 Upload and parse books from local files
 """
+import json
+import mmap
+import multiprocessing
 import os
+import queue
 import re
+import secrets
 import sqlite3
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from pathlib import Path
 
+from app.models import BUSY_TIMEOUT_MS, get_thread_connection
 from app.search import normalize_arabic
 
 
+# Pages per executemany() batch when saving a book
+PAGE_INSERT_BATCH_SIZE = 1000
+
+# Total bytes of book files below which a folder is parsed in-process.
+# Each spawned parse worker re-imports the app (about 1.5 s to start a
+# pool), while parsing runs at roughly 20 MB/s, so the pool only pays for
+# itself on a few tens of megabytes
+PARSE_POOL_MIN_BYTES = 32 * 1024 * 1024
+
+# Extensions picked up when scanning a folder for books
+BOOK_FILE_EXTENSIONS = ('.txt', '.md', '.markdown')
+
+# Bytes read to preview a file's #META# header in the folder scan
+HEADER_PREVIEW_BYTES = 2048
+
+# How long a folder scan waits for the write lock to store its header
+# previews; during an upload the cache is simply not updated this time
+FILE_CACHE_BUSY_TIMEOUT_MS = 100
+
+
+# ============================================================================
+# PRECOMPILED PATTERNS
+# ============================================================================
+
+# Granada metadata block: #META# ... #META#END#
+_META_BLOCK_RE = re.compile(r'#META#\s*\n(.*?)\n#META#END#', re.DOTALL)
+
+# OpenITI header fields (######OpenITI# ... #META#Header#End#), keyed by
+# field tag as in '#META# 020.BookTITLE :: value'
+_OPENITI_HEADER_END = '#META#Header#End#'
+_OPENITI_FIELDS = {
+    # Book info
+    '020.BookTITLE': 'title',
+    '020.BookTITLESUB': 'subtitle',
+    '029.BookTITLEalt': 'alt_title',
+    '021.BookSUBJ': 'subject',
+    '022.BookVOLS': 'volumes',
+    '025.BookLANG': 'language',
+    '000.BookURI': 'openiti_uri',
+    # Author info
+    '010.AuthorNAME': 'author',
+    '010.AuthorAKA': 'author_aka',
+    '011.AuthorBORN': 'author_born',
+    '011.AuthorDIED': 'author_death',
+    # Edition info
+    '040.EdEDITOR': 'editor',
+    '041.EdNUMBER': 'edition',
+    '043.EdPUBLISHER': 'publisher',
+    '044.EdPLACE': 'publication_place',
+    '045.EdYEAR': 'publication_year',
+    '049.EdISBN': 'isbn',
+    '049.EdPAGES': 'page_count',
+}
+_SUBJ_RE = re.compile(r'#META#\s*021\.BookSUBJ\s*::\s*(.+)')
+_LEADING_DIGITS_RE = re.compile(r'\d+')
+
+# OpenITI placeholder values that mean "no data"
+_NULL_SENTINELS = frozenset({'NODATA', 'NOTGIVEN', 'NOCODE', '9999', '-', ''})
+_OPENITI_NUMERIC_FIELDS = frozenset({'volumes', 'author_death', 'author_born', 'page_count'})
+
+# Granada #META# block keys mapped to standard keys
+_META_KEY_MAP = {
+    'Title': 'title',
+    'TitleLatin': 'title_latin',
+    'Author': 'author',
+    'AuthorDeath': 'author_death',
+    'Editor': 'editor',
+    'Publisher': 'publisher',
+    'Edition': 'edition',
+    'Volumes': 'volumes',
+}
+_META_NUMERIC_FIELDS = frozenset({'author_death', 'volumes'})
+
+# OpenITI filename: 4 digits + CamelCase author + dot + title + optional version
+_OPENITI_FILENAME_RE = re.compile(r'^(\d{4})([A-Za-z]+)\.([^.]+)(?:\.([^-]+))?(?:-([a-z]{3}\d?))?$')
+_CAMEL_RE = re.compile(r'([a-z])([A-Z])')
+
+# Punctuation stripped from titles when generating book IDs
+_TITLE_PUNCT_RE = re.compile(r'[^\w\s]')
+# Non-word characters stripped from author names to form author IDs
+_AUTHOR_ID_RE = re.compile(r'[^\w]')
+
+# Page markers
+_PAGE_VOL_RE = re.compile(r'---PAGE\s+V?(\d{1,2})P(\d{1,4})---')  # ---PAGE V01P001---
+_PAGE_SIMPLE_RE = re.compile(r'---PAGE\s+(\d+)---')  # ---PAGE 1---
+_PAGE_OPENITI_HASH_RE = re.compile(r'#?\s*PageV(\d{2})P(\d{2,4})')  # # PageV01P001
+_PAGE_OPENITI_RE = re.compile(r'PageV(\d{2})P(\d{2,4})')  # PageV01P001
+
+# TOC markers
+_TOC_TRIPLE_HASH_RE = re.compile(r'###\s*(\|+)\s*([^\n]*)')
+_TOC_HASH_PIPE_RE = re.compile(r'^#\s*\|\s*(.+)$', re.MULTILINE)
+_TOC_PIPE_RE = re.compile(r'^\|\s*([^|\n]+)$', re.MULTILINE)
+
+# Page and TOC markers in one pass, for parse_book_content_with_toc. Each
+# alternative is the corresponding pattern above; wrapping them in a
+# lookahead keeps matches zero-width, so a marker inside another marker's
+# span (e.g. a page marker inside a ### | heading line) is still found.
+# The leading first-character class lets the engine skip ahead cheaply
+# instead of trying all six alternatives at every position.
+_MARKER_RE = re.compile(
+    r'(?=[P\-#|])'
+    r'(?=(?P<page_openiti>PageV(?P<ov>\d{2})P(?P<op>\d{2,4}))'
+    r'|(?P<page_vol>---PAGE\s+V?(?P<vv>\d{1,2})P(?P<vp>\d{1,4})---)'
+    r'|(?P<page_simple>---PAGE\s+(?P<sp>\d+)---)'
+    r'|(?P<toc_triple_hash>###\s*(?P<tp>\|+)\s*(?P<tt>[^\n]*))'
+    r'|(?P<toc_hash_pipe>^#\s*\|\s*(?P<ht>.+)$)'
+    r'|(?P<toc_pipe>^\|\s*(?P<pt>[^|\n]+)$))',
+    re.MULTILINE
+)
+# Page marker kinds in priority order: only the first kind present is used
+_PAGE_MARKER_KINDS = ('page_openiti', 'page_vol', 'page_simple')
+
+# clean_markup substitutions (applied in this order)
+_CLEAN_PAGE_RE = re.compile(r'---PAGE[^-]*---|PageV\d+P\d+')
+# Same as \bms\d+\b, but starting with the literal lets the engine jump
+# straight to each 'ms' instead of trying every position
+_CLEAN_MILESTONE_RE = re.compile(r'ms(?<=\bms)\d+\b')
+_CLEAN_EDITORIAL_RE = re.compile(r'~~[^~]*~~')
+_CLEAN_TILDES_RE = re.compile(r'~~')
+_CLEAN_HEMISTICH_RE = re.compile(r'\s*%\s*')
+_CLEAN_LINE_NUMBER_RE = re.compile(r'\s+\d+\s*$', re.MULTILINE)
+_CLEAN_LEADING_NUMBER_RE = re.compile(r'^\d+\s*\n')
+_CLEAN_NUMBER_LINE_RE = re.compile(r'\n\d+\s*\n')
+_CLEAN_HASH_LINE_RE = re.compile(r'^#\s*', re.MULTILINE)
+_CLEAN_META_BLOCK_RE = re.compile(r'#META#.*?#META#END#', re.DOTALL)
+_CLEAN_META_HEADER_END_RE = re.compile(r'#META#Header#End#')
+_CLEAN_OPENITI_HEADER_RE = re.compile(r'######OpenITI#.*?#META#Header#End#', re.DOTALL)
+_CLEAN_SPACES_RE = re.compile(r'  +')
+_CLEAN_NEWLINES_RE = re.compile(r'\n{3,}')
+_CLEAN_BLANK_LINE_RE = re.compile(r'^\s+$', re.MULTILINE)
+
+
 def parse_metadata_header(content: str) -> Tuple[Dict[str, Any], str]:
     """
     Parse metadata header from book content.
@@ -26,8 +168,13 @@ def parse_metadata_header(content: str) -> Tuple[Dict[str, Any], str]:
     """
     metadata = {}
 
+    # Fail fast: both header formats need one of these markers
+    has_meta = '#META#' in content
+    if not has_meta and '######OpenITI#' not in content:
+        return metadata, content
+
     # Check for metadata block
-    meta_match = re.search(r'#META#\s*\n(.*?)\n#META#END#', content, re.DOTALL)
+    meta_match = _META_BLOCK_RE.search(content) if has_meta else None
 
     if meta_match:
         meta_block = meta_match.group(1)
@@ -41,21 +188,10 @@ def parse_metadata_header(content: str) -> Tuple[Dict[str, Any], str]:
                 value = value.strip()
 
                 # Map to standard keys
-                key_map = {
-                    'Title': 'title',
-                    'TitleLatin': 'title_latin',
-                    'Author': 'author',
-                    'AuthorDeath': 'author_death',
-                    'Editor': 'editor',
-                    'Publisher': 'publisher',
-                    'Edition': 'edition',
-                    'Volumes': 'volumes',
-                }
-
-                mapped_key = key_map.get(key, key.lower())
+                mapped_key = _META_KEY_MAP.get(key, key.lower())
 
                 # Convert numeric fields
-                if mapped_key in ('author_death', 'volumes'):
+                if mapped_key in _META_NUMERIC_FIELDS:
                     try:
                         value = int(value)
                     except ValueError:
@@ -66,58 +202,81 @@ def parse_metadata_header(content: str) -> Tuple[Dict[str, Any], str]:
         return metadata, remaining_content
 
     # Support OpenITI-style metadata (######OpenITI# header format)
-    if '#META#Header#End#' in content or '######OpenITI#' in content:
-        # Split at header end
-        if '#META#Header#End#' in content:
-            remaining_content = content.split('#META#Header#End#')[1].strip()
+    header_end = content.find(_OPENITI_HEADER_END)
+    if header_end != -1 or '######OpenITI#' in content:
+        # Split at header end; the fields are only looked up in the header
+        # itself rather than across the whole book
+        if header_end != -1:
+            header = content[:header_end]
+            body = content[header_end + len(_OPENITI_HEADER_END):]
+            remaining_content = body.split(_OPENITI_HEADER_END, 1)[0].strip()
         else:
-            remaining_content = content
-
-        # Extract ALL OpenITI metadata fields
-        openiti_patterns = {
-            # Book info
-            'title': r'#META#\s*020\.BookTITLE\s*::\s*(.+)',
-            'subtitle': r'#META#\s*020\.BookTITLESUB\s*::\s*(.+)',
-            'alt_title': r'#META#\s*029\.BookTITLEalt\s*::\s*(.+)',
-            'subject': r'#META#\s*021\.BookSUBJ\s*::\s*(.+)',
-            'volumes': r'#META#\s*022\.BookVOLS\s*::\s*(\d+)',
-            'language': r'#META#\s*025\.BookLANG\s*::\s*(.+)',
-            'openiti_uri': r'#META#\s*000\.BookURI\s*::\s*(.+)',
-            # Author info
-            'author': r'#META#\s*010\.AuthorNAME\s*::\s*(.+)',
-            'author_aka': r'#META#\s*010\.AuthorAKA\s*::\s*(.+)',
-            'author_born': r'#META#\s*011\.AuthorBORN\s*::\s*(\d+)',
-            'author_death': r'#META#\s*011\.AuthorDIED\s*::\s*(\d+)',
-            # Edition info
-            'editor': r'#META#\s*040\.EdEDITOR\s*::\s*(.+)',
-            'edition': r'#META#\s*041\.EdNUMBER\s*::\s*(.+)',
-            'publisher': r'#META#\s*043\.EdPUBLISHER\s*::\s*(.+)',
-            'publication_place': r'#META#\s*044\.EdPLACE\s*::\s*(.+)',
-            'publication_year': r'#META#\s*045\.EdYEAR\s*::\s*(.+)',
-            'isbn': r'#META#\s*049\.EdISBN\s*::\s*(.+)',
-            'page_count': r'#META#\s*049\.EdPAGES\s*::\s*(\d+)',
-        }
-
-        for key, pattern in openiti_patterns.items():
-            match = re.search(pattern, content)
-            if match:
-                value = match.group(1).strip()
-                # Skip NODATA/NOTGIVEN/9999/- values
-                if value in ('NODATA', 'NOTGIVEN', 'NOCODE', '9999', '-', ''):
+            header = remaining_content = content
+
+        # Extract ALL OpenITI metadata fields in one pass over the header
+        # lines; the first line carrying a field wins
+        seen = set()
+        for line in header.split('\n'):
+            pos = line.find('#META#')
+            if pos == -1:
+                continue
+            tag, sep, value = line[pos + 6:].partition('::')
+            key = _OPENITI_FIELDS.get(tag.strip()) if sep else None
+            if key is None or key in seen:
+                continue
+            value = value.strip()
+            if key in _OPENITI_NUMERIC_FIELDS:
+                # Numeric fields take the leading digits; a line without
+                # them does not count as the field
+                digits = _LEADING_DIGITS_RE.match(value)
+                if not digits:
                     continue
-                if key in ('volumes', 'author_death', 'author_born', 'page_count'):
-                    try:
-                        metadata[key] = int(value)
-                    except ValueError:
-                        pass
-                else:
-                    metadata[key] = value
+                value = digits.group()
+            seen.add(key)
+            # Skip NODATA/NOTGIVEN/9999/- values
+            if value in _NULL_SENTINELS:
+                continue
+            metadata[key] = int(value) if key in _OPENITI_NUMERIC_FIELDS else value
 
         return metadata, remaining_content
 
     return metadata, content
 
 
+# Common Arabic name transliterations
+_ARABIC_NAMES = {
+    'Abu': 'أبو', 'Ibn': 'ابن', 'Al': 'ال', 'Abd': 'عبد',
+    'Muhammad': 'محمد', 'Ahmad': 'أحمد', 'Ali': 'علي',
+    'Umar': 'عمر', 'Uthman': 'عثمان', 'Bukhari': 'البخاري',
+    'Muslim': 'مسلم', 'Tirmidhi': 'الترمذي', 'Nasai': 'النسائي',
+    'Malik': 'مالك', 'Hanbal': 'حنبل', 'Dawud': 'داود',
+    'Maja': 'ماجه', 'Darimi': 'الدارمي', 'Talib': 'طالب',
+    'Manaf': 'مناف', 'Diwan': 'ديوان', 'Sahih': 'صحيح',
+    'Sunan': 'سنن', 'Musnad': 'مسند', 'Muwatta': 'موطأ',
+    'Kitab': 'كتاب', 'Sharh': 'شرح', 'Tafsir': 'تفسير',
+}
+
+
+@lru_cache(maxsize=4096)
+def _camel_to_spaced(s: str) -> str:
+    """Insert a space before capital letters in a CamelCase name."""
+    return _CAMEL_RE.sub(r'\1 \2', s)
+
+
+@lru_cache(maxsize=4096)
+def _transliterate(text: str) -> str:
+    """Try to transliterate common terms of a CamelCase name to Arabic."""
+    return ' '.join(_ARABIC_NAMES.get(word, word) for word in _camel_to_spaced(text).split())
+
+
+@lru_cache(maxsize=8192)
+def _openiti_filename_groups(name: str) -> Optional[Tuple[Optional[str], ...]]:
+    """Match a file stem against the OpenITI pattern, caching the groups."""
+    # OpenITI pattern: 4 digits + CamelCase author + dot + title + optional version
+    match = _OPENITI_FILENAME_RE.match(name)
+    return match.groups() if match else None
+
+
 def parse_openiti_filename(filename: str) -> Optional[Dict[str, Any]]:
     """
     Parse OpenITI filename format to extract metadata.
@@ -135,51 +294,19 @@ def parse_openiti_filename(filename: str) -> Optional[Dict[str, Any]]:
     # Remove extension if present
     name = Path(filename).stem
 
-    # OpenITI pattern: 4 digits + CamelCase author + dot + title + optional version
-    pattern = r'^(\d{4})([A-Za-z]+)\.([^.]+)(?:\.([^-]+))?(?:-([a-z]{3}\d?))?$'
-    match = re.match(pattern, name)
+    groups = _openiti_filename_groups(name)
 
-    if not match:
+    if not groups:
         return None
 
-    death_date, author_camel, title_camel, version_id, lang = match.groups()
-
-    # Convert CamelCase to readable Arabic-friendly format
-    def camel_to_spaced(s):
-        # Insert space before capital letters
-        return re.sub(r'([a-z])([A-Z])', r'\1 \2', s)
-
-    # Common Arabic name transliterations
-    arabic_names = {
-        'Abu': 'أبو', 'Ibn': 'ابن', 'Al': 'ال', 'Abd': 'عبد',
-        'Muhammad': 'محمد', 'Ahmad': 'أحمد', 'Ali': 'علي',
-        'Umar': 'عمر', 'Uthman': 'عثمان', 'Bukhari': 'البخاري',
-        'Muslim': 'مسلم', 'Tirmidhi': 'الترمذي', 'Nasai': 'النسائي',
-        'Malik': 'مالك', 'Hanbal': 'حنبل', 'Dawud': 'داود',
-        'Maja': 'ماجه', 'Darimi': 'الدارمي', 'Talib': 'طالب',
-        'Manaf': 'مناف', 'Diwan': 'ديوان', 'Sahih': 'صحيح',
-        'Sunan': 'سنن', 'Musnad': 'مسند', 'Muwatta': 'موطأ',
-        'Kitab': 'كتاب', 'Sharh': 'شرح', 'Tafsir': 'تفسير',
-    }
-
-    def transliterate(text):
-        """Try to transliterate common terms to Arabic."""
-        words = camel_to_spaced(text).split()
-        result = []
-        for word in words:
-            # Check if we have an Arabic equivalent
-            if word in arabic_names:
-                result.append(arabic_names[word])
-            else:
-                result.append(word)
-        return ' '.join(result)
+    death_date, author_camel, title_camel, version_id, lang = groups
 
     return {
         'author_death': int(death_date),
-        'author': transliterate(author_camel),
-        'author_latin': camel_to_spaced(author_camel),
-        'title': transliterate(title_camel),
-        'title_latin': camel_to_spaced(title_camel),
+        'author': _transliterate(author_camel),
+        'author_latin': _camel_to_spaced(author_camel),
+        'title': _transliterate(title_camel),
+        'title_latin': _camel_to_spaced(title_camel),
         'openiti_id': name,
         'version_id': version_id,
         'source': 'openiti'
@@ -202,20 +329,23 @@ def parse_book_content(content: str) -> List[Dict[str, Any]]:
     # First extract metadata if present
     _, content = parse_metadata_header(content)
 
-    # Try different page marker patterns
+    # Try different page marker patterns, each with a literal it cannot
+    # match without, so absent formats are ruled out by a substring check
     patterns = [
         # New format: ---PAGE V01P001--- or ---PAGE 1---
-        (r'---PAGE\s+V?(\d{1,2})P(\d{1,4})---', True),  # With volume
-        (r'---PAGE\s+(\d+)---', False),  # Simple sequential
+        (_PAGE_VOL_RE, True, '---PAGE'),  # With volume
+        (_PAGE_SIMPLE_RE, False, '---PAGE'),  # Simple sequential
         # OpenITI format: # PageV01P001 or PageV01P001
-        (r'#?\s*PageV(\d{2})P(\d{2,4})', True),
+        (_PAGE_OPENITI_HASH_RE, True, 'PageV'),
     ]
 
     markers = []
     pattern_has_volume = False
 
-    for pattern, has_volume in patterns:
-        found = list(re.finditer(pattern, content))
+    for pattern, has_volume, literal in patterns:
+        if literal not in content:
+            continue
+        found = list(pattern.finditer(content))
         if found:
             markers = found
             pattern_has_volume = has_volume
@@ -239,7 +369,7 @@ def parse_book_content(content: str) -> List[Dict[str, Any]]:
             page_content = content[start_pos:end_pos].strip()
             page_content = clean_markup(page_content)
 
-            if page_content.strip():
+            if page_content:
                 pages.append({
                     'page_num': len(pages) + 1,
                     'volume': volume,
@@ -253,71 +383,97 @@ def parse_book_content(content: str) -> List[Dict[str, Any]]:
         # Split into ~2000 character pages, trying to break at paragraph boundaries
         chunk_size = 2000
 
-        paragraphs = content.split('\n\n')
-        current_chunk = ''
-
-        for para in paragraphs:
-            if len(current_chunk) + len(para) > chunk_size and current_chunk:
-                pages.append({
-                    'page_num': len(pages) + 1,
-                    'volume': 1,
-                    'original_page': len(pages) + 1,
-                    'content': current_chunk.strip()
-                })
-                current_chunk = para
-            else:
-                current_chunk += '\n\n' + para if current_chunk else para
-
-        # Don't forget the last chunk
-        if current_chunk.strip():
+        for chunk in _chunk_paragraphs(content, chunk_size):
             pages.append({
                 'page_num': len(pages) + 1,
                 'volume': 1,
                 'original_page': len(pages) + 1,
-                'content': current_chunk.strip()
+                'content': chunk.strip()
             })
 
     return pages
 
 
+def _chunk_paragraphs(text: str, chunk_size: int) -> List[str]:
+    """
+    Group the paragraphs of text into chunks of about chunk_size characters.
+
+    Paragraphs are collected in a list and joined once per chunk rather
+    than appended to a growing string. A trailing chunk with no content
+    is dropped.
+    """
+    chunks = []
+    parts = []
+    length = 0
+
+    for para in text.split('\n\n'):
+        if not length:
+            parts = [para]
+            length = len(para)
+        elif length + len(para) > chunk_size:
+            chunks.append('\n\n'.join(parts))
+            parts = [para]
+            length = len(para)
+        else:
+            parts.append(para)
+            length += len(para) + 2
+
+    last = '\n\n'.join(parts)
+    if last.strip():
+        chunks.append(last)
+
+    return chunks
+
+
 def clean_markup(text: str) -> str:
     """Remove OpenITI and other markup from text."""
-    # Remove page markers (all formats)
-    text = re.sub(r'---PAGE[^-]*---', '', text)
-    text = re.sub(r'PageV\d+P\d+', '', text)
+    # Each pass is skipped when its marker cannot occur in the text; most
+    # pages carry only a few marker types, so this avoids rescanning the
+    # page for the rest.
+
+    # Remove page markers (all formats) in one pass
+    if 'Page' in text or '---PAGE' in text:
+        text = _CLEAN_PAGE_RE.sub('', text)
 
     # Remove OpenITI milestone markers (ms0017, etc.)
-    text = re.sub(r'\bms\d+\b', '', text)
+    if 'ms' in text:
+        text = _CLEAN_MILESTONE_RE.sub('', text)
 
     # Remove editorial notes ~~text~~ and standalone ~~
-    text = re.sub(r'~~[^~]*~~', '', text)
-    text = re.sub(r'~~', '', text)
+    if '~~' in text:
+        text = _CLEAN_EDITORIAL_RE.sub('', text)
+        text = _CLEAN_TILDES_RE.sub('', text)
 
     # Remove hemistich markers (poetry: % text % or %~%)
-    text = text.replace('%~%', ' ')
-    text = re.sub(r'\s*%\s*', ' ', text)
+    if '%' in text:
+        text = text.replace('%~%', ' ')
+        text = _CLEAN_HEMISTICH_RE.sub(' ', text)
 
     # Remove line numbers at end of lines (common in poetry: verse text 123)
-    text = re.sub(r'\s+\d+\s*$', '', text, flags=re.MULTILINE)
+    text = _CLEAN_LINE_NUMBER_RE.sub('', text)
 
     # Remove standalone numbers at start of content (misplaced verse numbers)
-    text = re.sub(r'^\d+\s*\n', '', text)
-    text = re.sub(r'\n\d+\s*\n', '\n', text)
+    text = _CLEAN_LEADING_NUMBER_RE.sub('', text)
+    text = _CLEAN_NUMBER_LINE_RE.sub('\n', text)
 
-    # Remove # at start of lines (OpenITI comments/headers)
-    text = re.sub(r'^#\s*', '', text, flags=re.MULTILINE)
+    if '#' in text:
+        # Remove # at start of lines (OpenITI comments/headers)
+        text = _CLEAN_HASH_LINE_RE.sub('', text)
 
-    # Clean up metadata remnants
-    text = re.sub(r'#META#.*?#META#END#', '', text, flags=re.DOTALL)
-    text = re.sub(r'#META#Header#End#', '', text)
+        # Clean up metadata remnants
+        text = _CLEAN_META_BLOCK_RE.sub('', text)
+        text = _CLEAN_META_HEADER_END_RE.sub('', text)
 
-    # Remove OpenITI header block (######OpenITI# to #META#Header#End#)
-    text = re.sub(r'######OpenITI#.*?#META#Header#End#', '', text, flags=re.DOTALL)
+        # Remove OpenITI header block (######OpenITI# to #META#Header#End#)
+        text = _CLEAN_OPENITI_HEADER_RE.sub('', text)
 
     # Clean up extra whitespace
-    text = re.sub(r'[ \t]+', ' ', text)  # Multiple spaces to single
-    text = re.sub(r'\n{3,}', '\n\n', text)  # Multiple newlines to double
-    text = re.sub(r'^\s+$', '', text, flags=re.MULTILINE)  # Empty lines with whitespace
+    if '\t' in text:
+        text = text.replace('\t', ' ')  # Tabs to spaces
+    text = _CLEAN_SPACES_RE.sub(' ', text)  # Multiple spaces to single
+    if '\n\n\n' in text:
+        text = _CLEAN_NEWLINES_RE.sub('\n\n', text)  # Multiple newlines to double
+    text = _CLEAN_BLANK_LINE_RE.sub('', text)  # Empty lines with whitespace
     text = text.strip()
 
     return text
@@ -340,50 +496,45 @@ def extract_toc_entries(content: str) -> List[Dict[str, Any]]:
 
     # Pattern for ### | markers with varying levels
     # ### | title or ### || title or ### ||| title
-    pattern_triple_hash = r'###\s*(\|+)\s*([^\n]*)'
-    for match in re.finditer(pattern_triple_hash, content):
-        pipes = match.group(1)
-        title = match.group(2).strip()
-        level = len(pipes)  # Number of | determines level
-
-        if title:  # Only add if there's a title
-            toc_entries.append({
-                'title': title,
-                'level': level,
-                'char_pos': match.start()
-            })
+    for match in _TOC_TRIPLE_HASH_RE.finditer(content):
+        entry = _toc_entry('toc_triple_hash', match.group(2), match.start(), match.group(1))
+        if entry:
+            toc_entries.append(entry)
 
     # Pattern for # | title (single hash with pipe) - common in OpenITI
     # Match lines like "# | الحديث الاول"
-    pattern_hash_pipe = r'^#\s*\|\s*(.+)$'
-    for match in re.finditer(pattern_hash_pipe, content, re.MULTILINE):
-        title = match.group(1).strip()
-        if title and len(title) >= 3:
-            toc_entries.append({
-                'title': title,
-                'level': 1,  # Treat as level 1 (chapter/hadith)
-                'char_pos': match.start()
-            })
+    for match in _TOC_HASH_PIPE_RE.finditer(content):
+        entry = _toc_entry('toc_hash_pipe', match.group(1), match.start())
+        if entry:
+            toc_entries.append(entry)
 
     # Pattern for | at start of line (without #)
     # Match lines like "| الحديث الاول" or "| فصل"
-    pattern_pipe = r'^\|\s*([^|\n]+)$'
-    for match in re.finditer(pattern_pipe, content, re.MULTILINE):
-        title = match.group(1).strip()
-        # Skip if too short
-        if len(title) < 3:
-            continue
-
-        toc_entries.append({
-            'title': title,
-            'level': 2,  # Treat as level 2 (section)
-            'char_pos': match.start()
-        })
+    for match in _TOC_PIPE_RE.finditer(content):
+        entry = _toc_entry('toc_pipe', match.group(1), match.start())
+        if entry:
+            toc_entries.append(entry)
 
     # Sort by position in document
     toc_entries.sort(key=lambda x: x['char_pos'])
 
-    # Deduplicate entries with same title close together
+    return _dedupe_toc_entries(toc_entries)
+
+
+def _toc_entry(kind: str, title: str, char_pos: int, pipes: str = '') -> Optional[Dict[str, Any]]:
+    """Build a TOC entry for a matched marker, or None if it should be skipped."""
+    title = title.strip()
+    if kind == 'toc_triple_hash':
+        # Number of | determines level; only add if there's a title
+        return {'title': title, 'level': len(pipes), 'char_pos': char_pos} if title else None
+    if len(title) < 3:
+        return None
+    # # | title is treated as level 1 (chapter/hadith), | title as level 2 (section)
+    return {'title': title, 'level': 1 if kind == 'toc_hash_pipe' else 2, 'char_pos': char_pos}
+
+
+def _dedupe_toc_entries(toc_entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Deduplicate entries with same title close together."""
     deduped = []
     for entry in toc_entries:
         if not deduped or entry['title'] != deduped[-1]['title']:
@@ -392,47 +543,64 @@ def extract_toc_entries(content: str) -> List[Dict[str, Any]]:
     return deduped
 
 
-def parse_book_content_with_toc(content: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+def _scan_markers(content: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     """
-    Parse book content into pages and extract TOC entries.
+    Find page markers and TOC entries in a single pass over the content.
 
-    Returns (pages, toc_entries) where each toc_entry has page_num assigned.
+    Returns (page_markers, toc_entries), both in document order. Matches
+    of the same kind never overlap, as with a separate finditer per
+    pattern.
     """
-    # First extract TOC entries with character positions
-    toc_entries = extract_toc_entries(content)
+    markers = {kind: [] for kind in _PAGE_MARKER_KINDS}
+    toc_entries = []
+    last_end = {}
 
-    # Extract metadata
-    _, content_body = parse_metadata_header(content)
+    for match in _MARKER_RE.finditer(content):
+        kind = match.lastgroup
+        start = match.start()
+        if start < last_end.get(kind, 0):
+            continue
+        end = match.end(kind)
+        last_end[kind] = end
+
+        if kind == 'page_openiti':
+            vol, pg = int(match.group('ov')), int(match.group('op'))
+        elif kind == 'page_vol':
+            vol, pg = int(match.group('vv')), int(match.group('vp'))
+        elif kind == 'page_simple':
+            vol, pg = 1, int(match.group('sp'))
+        else:
+            if kind == 'toc_triple_hash':
+                entry = _toc_entry(kind, match.group('tt'), start, match.group('tp'))
+            else:
+                entry = _toc_entry(kind, match.group('ht' if kind == 'toc_hash_pipe' else 'pt'), start)
+            if entry:
+                toc_entries.append(entry)
+            continue
 
-    # Find page markers and their positions
-    page_markers = []
-    patterns = [
-        (r'PageV(\d{2})P(\d{2,4})', True),  # OpenITI: PageV01P001
-        (r'---PAGE\s+V?(\d{1,2})P(\d{1,4})---', True),  # With volume
-        (r'---PAGE\s+(\d+)---', False),  # Simple sequential
-    ]
+        markers[kind].append({
+            'volume': vol if vol > 0 else 1,
+            'original_page': pg,
+            'start_pos': end,
+            'marker_pos': start
+        })
 
-    for pattern, has_volume in patterns:
-        for match in re.finditer(pattern, content):
-            if has_volume:
-                vol = int(match.group(1))
-                pg = int(match.group(2))
-            else:
-                vol = 1
-                pg = int(match.group(1))
+    page_markers = next((markers[kind] for kind in _PAGE_MARKER_KINDS if markers[kind]), [])
+    return page_markers, toc_entries
 
-            page_markers.append({
-                'volume': vol if vol > 0 else 1,
-                'original_page': pg,
-                'start_pos': match.end(),
-                'marker_pos': match.start()
-            })
 
-        if page_markers:
-            break
+def parse_book_content_with_toc(content: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Parse book content into pages and extract TOC entries.
 
-    # Sort markers by position
-    page_markers.sort(key=lambda x: x['marker_pos'])
+    Returns (pages, toc_entries) where each toc_entry has page_num assigned.
+    """
+    # Find TOC entries and page markers with their character positions
+    page_markers, toc_entries = _scan_markers(content)
+    toc_entries = _dedupe_toc_entries(toc_entries)
+
+    # Extract metadata
+    _, content_body = parse_metadata_header(content)
 
     # Parse pages
     pages = []
@@ -441,7 +609,7 @@ def parse_book_content_with_toc(content: str) -> Tuple[List[Dict[str, Any]], Lis
         page_content = content[marker['start_pos']:end_pos].strip()
         page_content = clean_markup(page_content)
 
-        if page_content.strip():
+        if page_content:
             pages.append({
                 'page_num': len(pages) + 1,
                 'volume': marker['volume'],
@@ -455,43 +623,26 @@ def parse_book_content_with_toc(content: str) -> Tuple[List[Dict[str, Any]], Lis
     if not pages and content_body.strip():
         content_clean = clean_markup(content_body)
         chunk_size = 2000
-        paragraphs = content_clean.split('\n\n')
-        current_chunk = ''
         char_pos = 0
 
-        for para in paragraphs:
-            if len(current_chunk) + len(para) > chunk_size and current_chunk:
-                pages.append({
-                    'page_num': len(pages) + 1,
-                    'volume': 1,
-                    'original_page': len(pages) + 1,
-                    'content': current_chunk.strip(),
-                    'char_start': char_pos,
-                    'char_end': char_pos + len(current_chunk)
-                })
-                char_pos += len(current_chunk)
-                current_chunk = para
-            else:
-                current_chunk += '\n\n' + para if current_chunk else para
-
-        if current_chunk.strip():
+        for chunk in _chunk_paragraphs(content_clean, chunk_size):
             pages.append({
                 'page_num': len(pages) + 1,
                 'volume': 1,
                 'original_page': len(pages) + 1,
-                'content': current_chunk.strip(),
+                'content': chunk.strip(),
                 'char_start': char_pos,
-                'char_end': char_pos + len(current_chunk)
+                'char_end': char_pos + len(chunk)
             })
+            char_pos += len(chunk)
 
-    # Assign page numbers to TOC entries based on character position
+    # Assign page numbers to TOC entries based on character position. Both
+    # lists are in document order, so one merge walk over the pages is enough.
+    page_idx = -1
     for toc in toc_entries:
-        toc['page_num'] = 1  # Default
-        for page in pages:
-            if toc['char_pos'] >= page.get('char_start', 0):
-                toc['page_num'] = page['page_num']
-            else:
-                break
+        while page_idx + 1 < len(pages) and toc['char_pos'] >= pages[page_idx + 1].get('char_start', 0):
+            page_idx += 1
+        toc['page_num'] = pages[page_idx]['page_num'] if page_idx >= 0 else 1  # Default 1
 
     # Clean up internal fields from pages
     for page in pages:
@@ -501,18 +652,200 @@ def parse_book_content_with_toc(content: str) -> Tuple[List[Dict[str, Any]], Lis
     return pages, toc_entries
 
 
-def generate_book_id(title: str, author: str = None, death_date: int = None) -> str:
-    """Generate a unique book ID from metadata."""
-    import hashlib
-    import time
+def read_book_file(file_path) -> str:
+    """
+    Read a whole book file into a str.
+
+    The file is memory-mapped and decoded in one pass (UTF-8, falling back
+    to cp1256), so the bytes come straight from the OS page cache without
+    a buffered text reader in between. Newlines are normalized the same way
+    text mode would.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            try:
+                content = str(mm, 'utf-8')
+            except UnicodeDecodeError:
+                content = str(mm, 'cp1256')
+
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content
+
+
+def load_book_file(
+    file_path: str,
+    override_metadata: Dict[str, Any] = None
+) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    Read a book file and merge its metadata.
+
+    Returns (content, metadata), or (None, error_result) if the file cannot
+    be used.
+    """
+    path = Path(file_path)
+
+    if not path.exists():
+        return None, {'status': 'error', 'message': f'الملف غير موجود: {file_path}'}
+
+    # Check if it's an OpenITI file (no extension, matches pattern)
+    openiti_meta = parse_openiti_filename(path.name)
+
+    # Allow .txt, .md, .markdown, or OpenITI files (no extension)
+    if path.suffix.lower() not in BOOK_FILE_EXTENSIONS and path.suffix != '' and openiti_meta is None:
+        return None, {'status': 'error', 'message': 'صيغة الملف غير مدعومة. استخدم .txt أو .md أو ملفات OpenITI'}
+
+    try:
+        # Read file content
+        content = read_book_file(path)
+    except Exception as e:
+        return None, {'status': 'error', 'message': f'خطأ في قراءة الملف: {e}'}
+
+    if len(content) < 100:
+        return None, {'status': 'error', 'message': 'الملف فارغ أو قصير جداً'}
+
+    # Parse metadata from file content
+    content_meta, _ = parse_metadata_header(content)
+
+    # Merge metadata: OpenITI filename -> content header -> defaults
+    metadata = {}
+    if openiti_meta:
+        metadata.update(openiti_meta)
+    if content_meta:
+        metadata.update(content_meta)
+
+    # Apply overrides
+    if override_metadata:
+        metadata.update(override_metadata)
+
+    # Ensure required fields
+    if 'title' not in metadata:
+        # Use filename as title
+        metadata['title'] = path.stem.replace('_', ' ')
+
+    if 'author' not in metadata:
+        metadata['author'] = 'غير معروف'
+
+    return content, metadata
+
+
+def parse_book_file(file_path: str) -> Dict[str, Any]:
+    """
+    Read and parse a book file without touching the database.
+
+    Used as the worker function for parallel folder uploads, so it takes a
+    plain path and returns only picklable data: the error result, or
+    {'status': 'parsed', 'metadata', 'pages', 'toc_entries', 'file_size',
+    'subject'}.
+    """
+    content, metadata = load_book_file(file_path)
+    if content is None:
+        return metadata
+
+    pages, toc_entries = parse_book_content_with_toc(content)
+    return {
+        'status': 'parsed',
+        'metadata': metadata,
+        'pages': pages,
+        'toc_entries': toc_entries,
+        'file_size': len(content),
+        'subject': extract_subject(content)
+    }
+
+
+def extract_subject(content: str) -> Optional[str]:
+    """Extract just the OpenITI subject field from the metadata header."""
+    # The header is within the first 5000 chars
+    match = _SUBJ_RE.search(content, 0, 5000)
+    if match:
+        value = match.group(1).strip()
+        if value not in _NULL_SENTINELS:
+            return value
+
+    return None
 
+
+def iter_parsed_books(files: List[Path]) -> Iterator[Dict[str, Any]]:
+    """
+    Parse book files in worker processes, yielding results in file order.
+
+    Parsing is pure CPU work, so it is spread over a process pool while the
+    caller saves each book; at most a few parsed books per worker are held
+    in memory at once. A single file, or less than PARSE_POOL_MIN_BYTES in
+    total, is parsed in-process, where it finishes before a pool starts.
+    """
+    workers = min(os.cpu_count() or 1, len(files))
+    if workers <= 1 or _total_size(files) < PARSE_POOL_MIN_BYTES:
+        for f in files:
+            yield parse_book_file(str(f))
+        return
+
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        pending = deque()
+        for f in files:
+            pending.append(pool.submit(parse_book_file, str(f)))
+            if len(pending) >= workers * 2:
+                yield _parse_result(pending.popleft())
+        while pending:
+            yield _parse_result(pending.popleft())
+
+
+def _total_size(files: List[Path]) -> int:
+    """Combined size of files in bytes; unreadable files count as empty."""
+    total = 0
+    for f in files:
+        try:
+            total += os.path.getsize(f)
+        except OSError:
+            pass
+    return total
+
+
+def _parse_result(future) -> Dict[str, Any]:
+    """Unwrap a parse_book_file future, turning worker failures into error results."""
+    try:
+        return future.result()
+    except Exception as e:
+        return {'status': 'error', 'message': f'خطأ في معالجة الملف: {e}'}
+
+
+def find_book_files(folder: Path) -> List[Path]:
+    """
+    List the book files directly inside a folder in one directory pass.
+
+    Files with a text extension come first (.txt, then .md, then .markdown),
+    followed by OpenITI files, which are recognised by name since their
+    dotted names may appear to have any extension.
+    """
+    by_extension = {ext: [] for ext in BOOK_FILE_EXTENSIONS}
+    openiti_files = []
+
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            # Extensions match in any case, like the Windows glob this
+            # replaced (Book.TXT, Notes.MD)
+            name = entry.name.lower()
+            ext = next((e for e in BOOK_FILE_EXTENSIONS if name.endswith(e)), None)
+            if ext:
+                by_extension[ext].append(folder / entry.name)
+            elif entry.is_file() and parse_openiti_filename(entry.name):
+                openiti_files.append(folder / entry.name)
+
+    files = [f for ext in BOOK_FILE_EXTENSIONS for f in by_extension[ext]]
+    return files + openiti_files
+
+
+def generate_book_id(title: str) -> str:
+    """Generate a unique book ID from a title and a random suffix."""
     # Create base from title
-    base = re.sub(r'[^\w\s]', '', title)
+    base = _TITLE_PUNCT_RE.sub('', title)
     base = base.replace(' ', '_')[:30]
 
-    # Add hash for uniqueness
-    unique = f"{title}{author}{death_date}{time.time()}"
-    hash_suffix = hashlib.md5(unique.encode()).hexdigest()[:8]
+    # Add random suffix for uniqueness
+    hash_suffix = secrets.token_hex(4)
 
     return f"{base}_{hash_suffix}"
 
@@ -520,16 +853,69 @@ def generate_book_id(title: str, author: str = None, death_date: int = None) ->
 class BookUploader:
     """Handles uploading and processing local book files."""
 
+    # Statements used by _save_book, kept as constants so every call binds
+    # the same SQL text and hits the connection's statement cache
+    _SQL_INSERT_AUTHOR = '''
+        INSERT OR IGNORE INTO authors (id, name, death_date)
+        VALUES (?, ?, ?)
+    '''
+
+    _SQL_INSERT_BOOK = '''
+        INSERT INTO books (id, title, author_id, category_id, death_date,
+                           file_size, is_downloaded, download_date, source,
+                           volumes_count, editor, edition, publisher,
+                           author_name, author_aka, author_born, subtitle,
+                           alt_title, subject, language, publication_place,
+                           publication_year, isbn, page_count, openiti_uri)
+        VALUES (:book_id, :title, :author_id, :category_id, :author_death,
+                :file_size, 1, datetime('now'), :source,
+                :volumes, :editor, :edition, :publisher,
+                :author, :author_aka, :author_born, :subtitle,
+                :alt_title, :subject, :language, :publication_place,
+                :publication_year, :isbn, :page_count, :openiti_uri)
+    '''
+
+    # Metadata fields bound as-is into _SQL_INSERT_BOOK (None when missing)
+    _BOOK_METADATA_KEYS = (
+        'author_death', 'editor', 'edition', 'publisher', 'author',
+        'author_aka', 'author_born', 'subtitle', 'alt_title', 'subject',
+        'language', 'publication_place', 'publication_year', 'isbn',
+        'page_count', 'openiti_uri',
+    )
+
+    # Pages are staged in a TEMP table (in memory under temp_store=MEMORY)
+    # and copied over with one INSERT ... SELECT, so the pages_fts trigger
+    # runs inside a single statement instead of once per executemany row;
+    # that about halves the time to store a book
+    _SQL_CREATE_STAGED_PAGES = '''
+        CREATE TEMP TABLE IF NOT EXISTS staged_pages (
+            book_id TEXT, page_num INTEGER, volume INTEGER,
+            original_page INTEGER, content TEXT, content_normalized TEXT
+        )
+    '''
+
+    _SQL_INSERT_PAGE = '''
+        INSERT INTO temp.staged_pages (book_id, page_num, volume, original_page, content, content_normalized)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+
+    _SQL_COPY_STAGED_PAGES = '''
+        INSERT INTO main.pages (book_id, page_num, volume, original_page, content, content_normalized)
+        SELECT book_id, page_num, volume, original_page, content, content_normalized
+        FROM temp.staged_pages
+    '''
+
+    _SQL_INSERT_TOC = '''
+        INSERT INTO toc_entries (book_id, title, level, page_num, position)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+
     def __init__(self, db_path: str):
         self.db_path = db_path
 
     def _get_connection(self):
-        """Get database connection."""
-        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        conn.execute('PRAGMA journal_mode=WAL')
-        conn.execute('PRAGMA busy_timeout=30000')
-        return conn
+        """Get this thread's shared connection (the one get_db() uses in requests)."""
+        return get_thread_connection(self.db_path)
 
     def get_categories(self) -> List[Dict[str, Any]]:
         """Get list of available categories (main + custom)."""
@@ -546,14 +932,28 @@ class BookUploader:
         custom_categories = [{'id': row['id'], 'name': row['name'], 'is_custom': True}
                             for row in cursor.fetchall()]
 
-        conn.close()
-
         # Custom categories first, then main
         return custom_categories + main_categories
 
-    def _check_duplicate(self, book_id: str) -> Optional[Dict[str, Any]]:
-        """Check if a book with this ID already exists and is downloaded."""
-        conn = self._get_connection()
+    def _check_duplicate(
+        self,
+        book_id: str,
+        conn: sqlite3.Connection = None,
+        known_books: Dict[str, str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Check if a book with this ID already exists and is downloaded.
+
+        known_books, if given, is a preloaded {book_id: title} map of the
+        downloaded books (see _load_downloaded_books) used instead of a query.
+        """
+        if known_books is not None:
+            if book_id in known_books:
+                return {'id': book_id, 'title': known_books[book_id]}
+            return None
+
+        if conn is None:
+            conn = self._get_connection()
         cursor = conn.cursor()
 
         # Check for existing downloaded book with same ID
@@ -561,18 +961,32 @@ class BookUploader:
             SELECT id, title, is_downloaded FROM books WHERE id = ?
         ''', (book_id,))
         row = cursor.fetchone()
-        conn.close()
 
         if row and row['is_downloaded']:
             return {'id': row['id'], 'title': row['title']}
         return None
 
+    def _load_downloaded_books(self, conn: sqlite3.Connection) -> Dict[str, str]:
+        """Preload {book_id: title} for all downloaded books."""
+        rows = conn.execute('SELECT id, title FROM books WHERE is_downloaded').fetchall()
+        return {row['id']: row['title'] for row in rows}
+
+    def _load_categories(self, conn: sqlite3.Connection) -> Dict[str, Tuple[int, bool]]:
+        """Preload {name: (category_id, is_custom)}; main categories win over custom ones."""
+        categories = {row['name']: (row['id'], True)
+                      for row in conn.execute('SELECT id, name FROM custom_categories')}
+        categories.update({row['name']: (row['id'], False)
+                           for row in conn.execute('SELECT id, name FROM categories')})
+        return categories
+
     def upload_file(
         self,
         file_path: str,
         category_id: int = 1,
         is_custom_category: bool = False,
-        override_metadata: Dict[str, Any] = None
+        override_metadata: Dict[str, Any] = None,
+        batch_size: int = PAGE_INSERT_BATCH_SIZE,
+        conn: sqlite3.Connection = None
     ) -> Dict[str, Any]:
         """
         Upload a single book file.
@@ -582,65 +996,38 @@ class BookUploader:
             category_id: Category to assign the book to
             is_custom_category: Whether category_id refers to custom_categories table
             override_metadata: Optional metadata to override file metadata
+            batch_size: Number of pages inserted per executemany() batch
+            conn: Optional open connection to use instead of this thread's
 
         Returns:
             Dict with status and book info
         """
-        path = Path(file_path)
+        content, metadata = load_book_file(file_path, override_metadata)
+        if content is None:
+            return metadata
 
-        if not path.exists():
-            return {'status': 'error', 'message': f'الملف غير موجود: {file_path}'}
-
-        # Check if it's an OpenITI file (no extension, matches pattern)
-        is_openiti = parse_openiti_filename(path.name) is not None
-
-        # Allow .txt, .md, .markdown, or OpenITI files (no extension)
-        valid_extensions = ('.txt', '.md', '.markdown')
-        if path.suffix.lower() not in valid_extensions and path.suffix != '' and not is_openiti:
-            return {'status': 'error', 'message': 'صيغة الملف غير مدعومة. استخدم .txt أو .md أو ملفات OpenITI'}
-
-        try:
-            # Read file content
-            with open(path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            try:
-                with open(path, 'r', encoding='cp1256') as f:
-                    content = f.read()
-            except Exception as e:
-                return {'status': 'error', 'message': f'خطأ في قراءة الملف: {e}'}
-
-        if len(content) < 100:
-            return {'status': 'error', 'message': 'الملف فارغ أو قصير جداً'}
-
-        # Try to parse OpenITI filename first
-        openiti_meta = parse_openiti_filename(path.name)
-
-        # Parse metadata from file content
-        content_meta, _ = parse_metadata_header(content)
-
-        # Merge metadata: OpenITI filename -> content header -> defaults
-        metadata = {}
-        if openiti_meta:
-            metadata.update(openiti_meta)
-        if content_meta:
-            metadata.update(content_meta)
-
-        # Apply overrides
-        if override_metadata:
-            metadata.update(override_metadata)
+        # Check for duplicate before parsing the whole book
+        existing = self._duplicate_result(file_path, metadata, conn)
+        if existing:
+            return existing
 
-        # Ensure required fields
-        if 'title' not in metadata:
-            # Use filename as title
-            metadata['title'] = path.stem.replace('_', ' ')
+        # Parse content into pages and extract TOC
+        pages, toc_entries = parse_book_content_with_toc(content)
 
-        if 'author' not in metadata:
-            metadata['author'] = 'غير معروف'
+        return self._store_book(metadata, pages, toc_entries, category_id, is_custom_category,
+                                len(content), batch_size, conn)
 
+    def _duplicate_result(
+        self,
+        file_path: str,
+        metadata: Dict[str, Any],
+        conn: sqlite3.Connection = None,
+        known_books: Dict[str, str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Return the duplicate response if the book is already in the library."""
         # Check for duplicate using openiti_id or filename
-        openiti_id = metadata.get('openiti_id', path.stem)
-        existing = self._check_duplicate(openiti_id)
+        openiti_id = metadata.get('openiti_id', Path(file_path).stem)
+        existing = self._check_duplicate(openiti_id, conn, known_books)
         if existing:
             return {
                 'status': 'duplicate',
@@ -648,33 +1035,68 @@ class BookUploader:
                 'book_id': existing['id'],
                 'title': existing['title']
             }
+        return None
 
+    def _store_book(
+        self,
+        metadata: Dict[str, Any],
+        pages: List[Dict[str, Any]],
+        toc_entries: List[Dict[str, Any]],
+        category_id: int,
+        is_custom_category: bool,
+        file_size: int,
+        batch_size: int = PAGE_INSERT_BATCH_SIZE,
+        conn: sqlite3.Connection = None
+    ) -> Dict[str, Any]:
+        """Assign a book ID to a parsed book and save it."""
         # Generate book ID (use openiti_id if available for consistency)
         if metadata.get('openiti_id'):
             book_id = metadata['openiti_id']
         else:
-            book_id = generate_book_id(
-                metadata['title'],
-                metadata.get('author'),
-                metadata.get('author_death')
-            )
-
-        # Parse content into pages and extract TOC
-        pages, toc_entries = parse_book_content_with_toc(content)
+            book_id = generate_book_id(metadata['title'])
 
         if not pages:
             return {'status': 'error', 'message': 'فشل تحليل محتوى الكتاب'}
 
         # Save to database
-        return self._save_book(book_id, metadata, pages, toc_entries, category_id, is_custom_category, len(content))
+        return self._save_book(book_id, metadata, pages, toc_entries, category_id, is_custom_category,
+                               file_size, batch_size, conn)
 
-    def _get_or_create_category_from_subject(self, subject: str) -> Tuple[int, bool]:
+    def _upload_parsed(
+        self,
+        file_path: str,
+        parsed: Dict[str, Any],
+        category_id: int = 1,
+        is_custom_category: bool = False,
+        conn: sqlite3.Connection = None,
+        known_books: Dict[str, str] = None
+    ) -> Dict[str, Any]:
+        """Save a book already parsed by parse_book_file."""
+        if parsed['status'] != 'parsed':
+            return parsed
+
+        existing = self._duplicate_result(file_path, parsed['metadata'], conn, known_books)
+        if existing:
+            return existing
+
+        return self._store_book(parsed['metadata'], parsed['pages'], parsed['toc_entries'],
+                                category_id, is_custom_category, parsed['file_size'], conn=conn)
+
+    def _get_or_create_category_from_subject(
+        self,
+        subject: str,
+        conn: sqlite3.Connection = None,
+        known_categories: Dict[str, Tuple[int, bool]] = None
+    ) -> Tuple[int, bool]:
         """
         Get or create a category based on the subject field.
         Uses the first part of the subject hierarchy.
 
         Args:
             subject: Subject string like "السنن :: فقه الحديث :: كتب الحديث"
+            conn: Optional open connection to use instead of this thread's
+            known_categories: Optional preloaded map from _load_categories,
+                used instead of the lookups and updated with new categories
 
         Returns:
             Tuple of (category_id, is_custom)
@@ -686,57 +1108,38 @@ class BookUploader:
         parts = [p.strip() for p in subject.split('::')]
         category_name = parts[0] if parts else subject
 
-        conn = self._get_connection()
+        if conn is None:
+            conn = self._get_connection()
         cursor = conn.cursor()
 
+        if known_categories is not None:
+            if category_name in known_categories:
+                return known_categories[category_name]
+
+            cursor.execute('INSERT INTO custom_categories (name) VALUES (?)', (category_name,))
+            conn.commit()
+            known_categories[category_name] = (cursor.lastrowid, True)
+            return cursor.lastrowid, True
+
         # First check if category exists in main categories
         cursor.execute('SELECT id FROM categories WHERE name = ?', (category_name,))
         row = cursor.fetchone()
         if row:
-            conn.close()
             return row['id'], False
 
         # Check custom categories
         cursor.execute('SELECT id FROM custom_categories WHERE name = ?', (category_name,))
         row = cursor.fetchone()
         if row:
-            conn.close()
             return row['id'], True
 
         # Create new custom category
         cursor.execute('INSERT INTO custom_categories (name) VALUES (?)', (category_name,))
         new_id = cursor.lastrowid
         conn.commit()
-        conn.close()
 
         return new_id, True
 
-    def _get_file_subject(self, file_path: str) -> Optional[str]:
-        """
-        Read a file and extract just the subject field from metadata.
-        """
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                # Read first 5000 chars to get metadata header
-                content = f.read(5000)
-        except UnicodeDecodeError:
-            try:
-                with open(file_path, 'r', encoding='cp1256') as f:
-                    content = f.read(5000)
-            except Exception:
-                return None
-        except Exception:
-            return None
-
-        # Extract subject from OpenITI metadata
-        match = re.search(r'#META#\s*021\.BookSUBJ\s*::\s*(.+)', content)
-        if match:
-            value = match.group(1).strip()
-            if value not in ('NODATA', 'NOTGIVEN', 'NOCODE', ''):
-                return value
-
-        return None
-
     def upload_folder(
         self,
         folder_path: str,
@@ -764,16 +1167,8 @@ class BookUploader:
         if not path.is_dir():
             return {'status': 'error', 'message': 'المسار ليس مجلداً'}
 
-        # Find all text files
-        files = list(path.glob('*.txt')) + list(path.glob('*.md')) + list(path.glob('*.markdown'))
-
-        # Also find OpenITI files (match pattern, not already in list)
-        # OpenITI files have dots as separators, so they may appear to have extensions
-        for f in path.iterdir():
-            if f.is_file() and f not in files:
-                # Check if it matches OpenITI pattern
-                if parse_openiti_filename(f.name):
-                    files.append(f)
+        # Find all text files and OpenITI files
+        files = find_book_files(path)
 
         if not files:
             return {'status': 'error', 'message': 'لا توجد ملفات كتب في المجلد'}
@@ -781,20 +1176,28 @@ class BookUploader:
         results = []
         success_count = 0
 
-        for file_path in files:
+        # Each book is saved in its own transaction; existing books and
+        # categories are looked up once for the whole folder
+        conn = self._get_connection()
+        known_books = self._load_downloaded_books(conn)
+        known_categories = self._load_categories(conn)
+
+        for file_path, parsed in zip(files, iter_parsed_books(files)):
             # Determine category for this file
             file_category_id = category_id
             file_is_custom = is_custom_category
             auto_category_name = None
 
             if auto_assign:
-                # Try to get subject from file and create/find category
-                subject = self._get_file_subject(str(file_path))
+                # Use the subject from the already-read file to create/find category
+                subject = parsed.get('subject')
                 if subject:
-                    file_category_id, file_is_custom = self._get_or_create_category_from_subject(subject)
+                    file_category_id, file_is_custom = self._get_or_create_category_from_subject(
+                        subject, conn, known_categories)
                     auto_category_name = subject.split('::')[0].strip()
 
-            result = self.upload_file(str(file_path), file_category_id, file_is_custom)
+            result = self._upload_parsed(str(file_path), parsed, file_category_id, file_is_custom,
+                                         conn, known_books)
             result['filename'] = file_path.name
             if auto_category_name:
                 result['auto_category'] = auto_category_name
@@ -802,6 +1205,7 @@ class BookUploader:
 
             if result['status'] == 'success':
                 success_count += 1
+                known_books[result['book_id']] = result['title']
 
         return {
             'status': 'success' if success_count > 0 else 'error',
@@ -829,21 +1233,19 @@ class BookUploader:
         if not path.is_dir():
             return {'status': 'error', 'message': 'المسار ليس مجلداً'}
 
-        # Find standard text files
-        files = list(path.glob('*.txt')) + list(path.glob('*.md')) + list(path.glob('*.markdown'))
+        # Find standard text files and OpenITI files
+        files = find_book_files(path)
 
-        # Also find OpenITI files (match pattern, not already in list)
-        # OpenITI files have dots as separators, so they may appear to have extensions
-        for f in path.iterdir():
-            if f.is_file() and f not in files:
-                # Check if it matches OpenITI pattern
-                if parse_openiti_filename(f.name):
-                    files.append(f)
+        # Header previews are cached by (path, mtime, size) so unchanged
+        # files are not reopened on every listing
+        conn = self._get_connection()
+        cache_rows = []
 
         file_list = []
         for f in files:
             try:
-                size = f.stat().st_size
+                stat = f.stat()
+                size = stat.st_size
 
                 # Try to parse OpenITI filename first
                 openiti_meta = parse_openiti_filename(f.name)
@@ -860,19 +1262,29 @@ class BookUploader:
                         'is_openiti': True
                     })
                 else:
-                    # Try to read first few lines for title
-                    with open(f, 'r', encoding='utf-8') as fp:
-                        preview = fp.read(500)
-
-                    metadata, _ = parse_metadata_header(preview)
+                    cached = conn.execute('''
+                        SELECT title, author FROM file_cache
+                        WHERE path = ? AND mtime = ? AND size = ?
+                    ''', (str(f), stat.st_mtime_ns, size)).fetchone()
+
+                    if cached:
+                        title, author = cached['title'], cached['author']
+                    else:
+                        # Try to read first few lines for title
+                        with open(f, 'rb') as fp:
+                            preview = fp.read(HEADER_PREVIEW_BYTES).decode('utf-8', 'ignore')
+
+                        metadata, _ = parse_metadata_header(preview)
+                        title, author = metadata.get('title'), metadata.get('author')
+                        cache_rows.append((str(f), stat.st_mtime_ns, size, title, author))
 
                     file_list.append({
                         'path': str(f),
                         'name': f.name,
                         'size': size,
                         'size_formatted': f"{size / 1024:.1f} KB" if size < 1024*1024 else f"{size / (1024*1024):.1f} MB",
-                        'title': metadata.get('title', f.stem),
-                        'author': metadata.get('author', 'غير معروف'),
+                        'title': f.stem if title is None else title,
+                        'author': 'غير معروف' if author is None else author,
                         'is_openiti': False
                     })
             except Exception:
@@ -886,6 +1298,21 @@ class BookUploader:
                     'is_openiti': False
                 })
 
+        if cache_rows:
+            # Best effort: the listing is already complete without the cache
+            conn.execute(f'PRAGMA busy_timeout={FILE_CACHE_BUSY_TIMEOUT_MS}')
+            try:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO file_cache (path, mtime, size, title, author)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', cache_rows)
+                conn.commit()
+            except sqlite3.OperationalError:
+                # Write lock held (e.g. by the upload writer); skip caching
+                conn.rollback()
+            finally:
+                conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+
         return {
             'status': 'success',
             'files': file_list,
@@ -900,57 +1327,44 @@ class BookUploader:
         toc_entries: List[Dict[str, Any]],
         category_id: int,
         is_custom_category: bool,
-        file_size: int
+        file_size: int,
+        batch_size: int = PAGE_INSERT_BATCH_SIZE,
+        conn: sqlite3.Connection = None
     ) -> Dict[str, Any]:
-        """Save book, pages, and TOC to database."""
-        conn = self._get_connection()
+        """Save book, pages, and TOC to database in one transaction."""
+        if conn is None:
+            conn = self._get_connection()
         cursor = conn.cursor()
 
         try:
-            # Create author if needed
-            author_id = re.sub(r'[^\w]', '', metadata.get('author', 'Unknown'))[:20]
+            # Take the write lock up front so the whole book is one transaction
+            if not conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')
 
-            cursor.execute('SELECT id FROM authors WHERE id = ?', (author_id,))
-            if not cursor.fetchone():
-                cursor.execute('''
-                    INSERT INTO authors (id, name, death_date)
-                    VALUES (?, ?, ?)
-                ''', (author_id, metadata.get('author', 'غير معروف'),
-                      metadata.get('author_death')))
-
-            # If book already exists, delete it first (re-upload scenario)
-            cursor.execute('SELECT id FROM books WHERE id = ?', (book_id,))
-            if cursor.fetchone():
-                # Delete existing book data
+            # Create author if needed
+            author_id = _AUTHOR_ID_RE.sub('', metadata.get('author', 'Unknown'))[:20]
+            cursor.execute(self._SQL_INSERT_AUTHOR,
+                           (author_id, metadata.get('author', 'غير معروف'),
+                            metadata.get('author_death')))
+
+            # If book already exists, delete it first (re-upload scenario);
+            # the book row's delete doubles as the existence probe
+            cursor.execute('DELETE FROM books WHERE id = ?', (book_id,))
+            if cursor.rowcount:
                 cursor.execute('DELETE FROM pages WHERE book_id = ?', (book_id,))
-                cursor.execute('DELETE FROM pages_fts WHERE book_id = ?', (book_id,))
                 cursor.execute('DELETE FROM toc_entries WHERE book_id = ?', (book_id,))
-                cursor.execute('DELETE FROM books WHERE id = ?', (book_id,))
 
             # For custom categories, set category_id to NULL in books table
             main_category_id = None if is_custom_category else category_id
 
             # Insert book with all metadata
-            source = metadata.get('source', 'local')
-            cursor.execute('''
-                INSERT INTO books (id, title, author_id, category_id, death_date,
-                                   file_size, is_downloaded, download_date, source,
-                                   volumes_count, editor, edition, publisher,
-                                   author_name, author_aka, author_born, subtitle,
-                                   alt_title, subject, language, publication_place,
-                                   publication_year, isbn, page_count, openiti_uri)
-                VALUES (?, ?, ?, ?, ?, ?, 1, datetime('now'), ?, ?, ?, ?, ?,
-                        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (book_id, metadata.get('title', 'بدون عنوان'), author_id, main_category_id,
-                  metadata.get('author_death'), file_size, source,
-                  metadata.get('volumes', 1), metadata.get('editor'),
-                  metadata.get('edition'), metadata.get('publisher'),
-                  metadata.get('author'), metadata.get('author_aka'),
-                  metadata.get('author_born'), metadata.get('subtitle'),
-                  metadata.get('alt_title'), metadata.get('subject'),
-                  metadata.get('language'), metadata.get('publication_place'),
-                  metadata.get('publication_year'), metadata.get('isbn'),
-                  metadata.get('page_count'), metadata.get('openiti_uri')))
+            title = metadata.get('title', 'بدون عنوان')
+            book_row = {key: metadata.get(key) for key in self._BOOK_METADATA_KEYS}
+            book_row.update(book_id=book_id, title=title, author_id=author_id,
+                            category_id=main_category_id, file_size=file_size,
+                            source=metadata.get('source', 'local'),
+                            volumes=metadata.get('volumes', 1))
+            cursor.execute(self._SQL_INSERT_BOOK, book_row)
 
             # If custom category, add to book_custom_categories
             if is_custom_category:
@@ -959,28 +1373,24 @@ class BookUploader:
                     VALUES (?, ?)
                 ''', (book_id, category_id))
 
-            # Insert pages
-            for page in pages:
-                normalized = normalize_arabic(page['content'])
+            # Stage pages in batches, then copy them into pages in one
+            # statement; the pages_fts triggers index each row as it lands
+            cursor.execute(self._SQL_CREATE_STAGED_PAGES)
+            for start in range(0, len(pages), batch_size):
+                page_rows = [(book_id, page['page_num'], page.get('volume', 1),
+                              page.get('original_page', page['page_num']),
+                              page['content'], normalize_arabic(page['content']))
+                             for page in pages[start:start + batch_size]]
 
-                cursor.execute('''
-                    INSERT INTO pages (book_id, page_num, volume, original_page, content, content_normalized)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (book_id, page['page_num'], page.get('volume', 1),
-                      page.get('original_page', page['page_num']), page['content'], normalized))
+                cursor.executemany(self._SQL_INSERT_PAGE, page_rows)
 
-                cursor.execute('''
-                    INSERT INTO pages_fts (book_id, page_num, content)
-                    VALUES (?, ?, ?)
-                ''', (book_id, str(page['page_num']), normalized))
+            cursor.execute(self._SQL_COPY_STAGED_PAGES)
+            cursor.execute('DELETE FROM temp.staged_pages')
 
             # Insert TOC entries
-            for i, toc in enumerate(toc_entries):
-                cursor.execute('''
-                    INSERT INTO toc_entries (book_id, title, level, page_num, position)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (book_id, toc['title'], toc.get('level', 1),
-                      toc.get('page_num', 1), i + 1))
+            cursor.executemany(self._SQL_INSERT_TOC, [
+                (book_id, toc['title'], toc.get('level', 1), toc.get('page_num', 1), i + 1)
+                for i, toc in enumerate(toc_entries)])
 
             # Create reading progress entry
             cursor.execute('''
@@ -993,7 +1403,7 @@ class BookUploader:
             return {
                 'status': 'success',
                 'book_id': book_id,
-                'title': metadata.get('title', 'بدون عنوان'),
+                'title': title,
                 'pages': len(pages),
                 'toc_count': len(toc_entries),
                 'message': f'تم رفع الكتاب بنجاح ({len(pages)} صفحة، {len(toc_entries)} فصل)'
@@ -1003,8 +1413,100 @@ class BookUploader:
             conn.rollback()
             return {'status': 'error', 'message': f'خطأ في حفظ الكتاب: {e}'}
 
-        finally:
-            conn.close()
+
+# ============================================================================
+# BACKGROUND UPLOADS
+# ============================================================================
+
+# One job queue (and writer thread) per database path; every queued upload
+# for a database runs on its thread, so ingest writes never contend
+_upload_queues: Dict[str, queue.Queue] = {}
+_upload_queues_lock = threading.Lock()
+
+
+def _set_upload_state(conn: sqlite3.Connection, job_id: int, state: str,
+                      result: Dict[str, Any] = None):
+    """Record a job's state (and final result) in upload_status."""
+    try:
+        conn.execute('''
+            UPDATE upload_status SET state = ?, result = ?, updated_at = datetime('now')
+            WHERE id = ?
+        ''', (state, json.dumps(result, ensure_ascii=False) if result else None, job_id))
+        conn.commit()
+    except Exception:
+        # Don't leave the failed update open on the writer's connection
+        conn.rollback()
+        raise
+
+
+def _finish_upload(conn: sqlite3.Connection, job_id: int, result: Dict[str, Any]):
+    """Mark a job done; if its result cannot be stored, store the error instead."""
+    try:
+        _set_upload_state(conn, job_id, 'done', result)
+    except Exception as e:
+        _set_upload_state(conn, job_id, 'done',
+                          {'status': 'error', 'message': f'خطأ في حفظ نتيجة الرفع: {e}'})
+
+
+def _upload_worker(db_path: str, jobs: queue.Queue):
+    """Run queued BookUploader calls one at a time on one connection."""
+    uploader = BookUploader(db_path)
+    while True:
+        job_id, method, args, on_done = jobs.get()
+        # Nothing may escape the loop: submit_upload never restarts this
+        # thread, and the wizard polls each job until it is 'done'
+        try:
+            conn = uploader._get_connection()
+            try:
+                _set_upload_state(conn, job_id, 'running')
+                result = getattr(uploader, method)(*args)
+            except Exception as e:
+                result = {'status': 'error', 'message': f'خطأ في رفع الكتاب: {e}'}
+            _finish_upload(conn, job_id, result)
+            if on_done is not None:
+                on_done()
+        except Exception as e:
+            print(f"Upload job {job_id} failed: {e}")
+
+
+def submit_upload(db_path: str, method: str, args: tuple, path: str,
+                  on_done=None) -> int:
+    """
+    Queue BookUploader.<method>(*args) on the database's writer thread.
+
+    Returns the upload_status row id; on_done (if given) is called on the
+    writer thread after the job finishes.
+    """
+    conn = BookUploader(db_path)._get_connection()
+    cursor = conn.execute('''
+        INSERT INTO upload_status (kind, path, state) VALUES (?, ?, 'queued')
+    ''', (method, path))
+    conn.commit()
+    job_id = cursor.lastrowid
+
+    with _upload_queues_lock:
+        jobs = _upload_queues.get(db_path)
+        if jobs is None:
+            jobs = _upload_queues[db_path] = queue.Queue()
+            threading.Thread(target=_upload_worker, args=(db_path, jobs),
+                             name='granada-upload', daemon=True).start()
+    jobs.put((job_id, method, args, on_done))
+    return job_id
+
+
+def get_upload_status(db_path: str, job_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Get a queued upload's status: the upload result once it has finished,
+    otherwise {'status': 'queued' | 'running'}. None if the job is unknown.
+    """
+    conn = BookUploader(db_path)._get_connection()
+    row = conn.execute('SELECT state, result FROM upload_status WHERE id = ?',
+                       (job_id,)).fetchone()
+    if row is None:
+        return None
+    if row['state'] != 'done':
+        return {'status': row['state'], 'job_id': job_id}
+    return dict(json.loads(row['result']), job_id=job_id)
 
 
 # Format documentation for UI display
@@ -0,0 +1,69 @@
+"""
+Native file and folder pickers for the upload and export forms.
+
+Tk wants to own the main thread of its process and is not safe to drive
+from a server worker thread, so each dialog is shown by a short-lived
+child process and only the chosen path comes back.
+"""
+import multiprocessing
+
+# Seconds to wait for the user before closing a forgotten dialog
+DIALOG_TIMEOUT = 300
+
+
+def _show_dialog(conn, kind, title, filetypes):
+    """Child process: show one dialog and send back (ok, path or error)."""
+    try:
+        import tkinter as tk
+        from tkinter import filedialog
+
+        # Create hidden root window
+        root = tk.Tk()
+        root.withdraw()
+        root.attributes('-topmost', True)
+
+        if kind == 'file':
+            path = filedialog.askopenfilename(title=title, filetypes=filetypes)
+        else:
+            path = filedialog.askdirectory(title=title)
+
+        root.destroy()
+        conn.send((True, path or ''))
+    except Exception as e:
+        conn.send((False, str(e)))
+    finally:
+        conn.close()
+
+
+def pick_path(kind, title, filetypes=()):
+    """
+    Ask the user for a file (kind='file') or a folder (kind='folder').
+
+    Returns the chosen path, or '' if the dialog was cancelled or left
+    open past DIALOG_TIMEOUT. Raises RuntimeError if the dialog could
+    not be shown.
+    """
+    # Spawn like the upload workers do; in the frozen build the child is
+    # started through the executable and picked up by freeze_support()
+    ctx = multiprocessing.get_context('spawn')
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_show_dialog, args=(sender, kind, title, list(filetypes)),
+                          daemon=True)
+    process.start()
+    sender.close()
+
+    try:
+        if not receiver.poll(DIALOG_TIMEOUT):
+            return ''
+        ok, result = receiver.recv()
+    except EOFError:
+        raise RuntimeError('تعذر فتح نافذة الاختيار')
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+    if not ok:
+        raise RuntimeError(result)
+    return result
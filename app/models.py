@@ -4,24 +4,128 @@ SQLite with FTS5 for full-text search
 """
 import sqlite3
 import os
+import threading
+
+_thread_connections = threading.local()
+
+# Prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 256
+
+# How long a connection waits on another writer's lock before failing
+BUSY_TIMEOUT_MS = 30000
 
 
 def get_db_connection(db_path):
     """Create a database connection with timeout and proper settings."""
-    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    # Connections are long-lived per thread; size the statement cache to
+    # hold every query the routes issue (the stdlib default is 128)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
     # Enable WAL mode for better concurrency
     conn.execute('PRAGMA journal_mode=WAL')
-    conn.execute('PRAGMA busy_timeout=30000')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    # WAL only needs fsync at checkpoints; NORMAL can lose the last commit on
+    # power loss but never corrupts the database
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA mmap_size=268435456')  # 256 MiB
+    conn.execute('PRAGMA cache_size=-65536')  # 64 MiB
+    conn.execute('PRAGMA wal_autocheckpoint=1000')
+    return conn
+
+
+def get_thread_connection(db_path, create=True):
+    """
+    Get this thread's long-lived connection to db_path, opening it on first
+    use. Callers must not close it; returns None if create is False and the
+    thread has no connection yet.
+    """
+    connections = getattr(_thread_connections, 'by_path', None)
+    if connections is None:
+        connections = _thread_connections.by_path = {}
+
+    conn = connections.get(db_path)
+    if conn is None and create:
+        conn = connections[db_path] = get_db_connection(db_path)
     return conn
 
 
-def init_db(db_path):
-    """Initialize the database with schema."""
+# Full-text index over pages.content_normalized. It is an external-content
+# FTS5 table: only the index is stored, the text is read back from pages,
+# and the triggers keep it in sync with inserts, updates and deletes.
+PAGES_FTS_TABLE_SQL = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+        content_normalized,
+        content='pages',
+        content_rowid='id',
+        tokenize='unicode61'
+    );
+'''
+
+PAGES_FTS_TRIGGERS_SQL = '''
+    CREATE TRIGGER IF NOT EXISTS pages_fts_ai AFTER INSERT ON pages BEGIN
+        INSERT INTO pages_fts (rowid, content_normalized)
+        VALUES (new.id, new.content_normalized);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS pages_fts_ad AFTER DELETE ON pages BEGIN
+        INSERT INTO pages_fts (pages_fts, rowid, content_normalized)
+        VALUES ('delete', old.id, old.content_normalized);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS pages_fts_au AFTER UPDATE ON pages BEGIN
+        INSERT INTO pages_fts (pages_fts, rowid, content_normalized)
+        VALUES ('delete', old.id, old.content_normalized);
+        INSERT INTO pages_fts (rowid, content_normalized)
+        VALUES (new.id, new.content_normalized);
+    END;
+'''
+
+
+def _pages_fts_is_external(cursor):
+    """Return True/False for an external-content/standalone pages_fts, None if missing."""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'pages_fts'")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return "content='pages'" in row[0]
+
+
+def migrate_pages_fts(conn):
+    """
+    Convert a standalone pages_fts table (which stored its own copy of every
+    page's normalized text) to the external-content index and rebuild it.
+    """
+    cursor = conn.cursor()
+    if _pages_fts_is_external(cursor) is not False:
+        return
+
+    print("Rebuilding search index as an external-content table...")
+    conn.commit()
+    cursor.executescript(
+        'BEGIN IMMEDIATE;'
+        'DROP TABLE pages_fts;'
+        + PAGES_FTS_TABLE_SQL
+        + PAGES_FTS_TRIGGERS_SQL
+        + "INSERT INTO pages_fts (pages_fts) VALUES ('rebuild');"
+        'COMMIT;'
+    )
+
+
+def init_db(db_path, conn=None):
+    """
+    Initialize the database with schema.
+
+    If an open connection is passed it is used (and left open) instead of
+    opening a new one, so startup tasks can share a single connection.
+    """
     # Ensure directory exists
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
-    conn = get_db_connection(db_path)
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection(db_path)
     cursor = conn.cursor()
 
     # Create tables
@@ -59,6 +163,14 @@ def init_db(db_path):
             FOREIGN KEY (category_id) REFERENCES categories(id)
         );
 
+        -- Library listing order and keyset pagination cursor
+        CREATE INDEX IF NOT EXISTS idx_books_title_id ON books(title, id);
+        -- Author pages/deletes and per-category listings and counts
+        CREATE INDEX IF NOT EXISTS idx_books_author ON books(author_id);
+        CREATE INDEX IF NOT EXISTS idx_books_category ON books(category_id, is_downloaded);
+        -- Filtered search counts: the per-match book lookup stays in the index
+        CREATE INDEX IF NOT EXISTS idx_books_search_filters ON books(id, author_id, category_id);
+
         -- Book pages/content
         CREATE TABLE IF NOT EXISTS pages (
             id INTEGER PRIMARY KEY,
@@ -72,7 +184,6 @@ def init_db(db_path):
         );
 
         -- Create indexes for pages
-        CREATE INDEX IF NOT EXISTS idx_pages_book ON pages(book_id);
         CREATE INDEX IF NOT EXISTS idx_pages_book_page ON pages(book_id, page_num);
         -- Note: idx_pages_volume_page is created by migration after columns are added
 
@@ -109,6 +220,10 @@ def init_db(db_path):
             FOREIGN KEY (category_id) REFERENCES custom_categories(id)
         );
 
+        -- The primary key leads with book_id; this serves lookups by category
+        CREATE INDEX IF NOT EXISTS idx_book_custom_categories_category
+            ON book_custom_categories(category_id);
+
         -- Reading collections (Granada feature)
         CREATE TABLE IF NOT EXISTS collections (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -125,6 +240,11 @@ def init_db(db_path):
             FOREIGN KEY (book_id) REFERENCES books(id)
         );
 
+        -- Books of a collection in reading order, covering the listing and
+        -- export joins and the next-position lookup without a sort
+        CREATE INDEX IF NOT EXISTS idx_collection_books_pos
+            ON collection_books(collection_id, position, book_id);
+
         -- Reading progress (Granada feature)
         CREATE TABLE IF NOT EXISTS reading_progress (
             book_id TEXT PRIMARY KEY,
@@ -160,7 +280,7 @@ def init_db(db_path):
             FOREIGN KEY (book_id) REFERENCES books(id)
         );
 
-        CREATE INDEX IF NOT EXISTS idx_toc_book ON toc_entries(book_id);
+        CREATE INDEX IF NOT EXISTS idx_toc_book_pos ON toc_entries(book_id, position);
         CREATE INDEX IF NOT EXISTS idx_toc_page ON toc_entries(book_id, page_num);
 
         -- Notes and annotations (Granada feature)
@@ -175,20 +295,38 @@ def init_db(db_path):
 
         CREATE INDEX IF NOT EXISTS idx_notes_created ON notes(created_at);
         CREATE INDEX IF NOT EXISTS idx_notes_source ON notes(source_type);
-    ''')
 
-    # Create FTS5 virtual table for full-text search
-    cursor.execute('''
-        CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
-            book_id,
-            page_num,
-            content,
-            tokenize='unicode61'
+        -- Background upload jobs (state: queued, running, done)
+        CREATE TABLE IF NOT EXISTS upload_status (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,       -- 'upload_file' or 'upload_folder'
+            path TEXT,
+            state TEXT NOT NULL,
+            result TEXT,              -- JSON upload result once done
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+
+        -- Header previews shown by the folder scan, keyed by file path
+        CREATE TABLE IF NOT EXISTS file_cache (
+            path TEXT PRIMARY KEY,
+            mtime INTEGER NOT NULL,   -- st_mtime_ns
+            size INTEGER NOT NULL,
+            title TEXT,
+            author TEXT
         );
     ''')
 
+    # Create FTS5 virtual table for full-text search. A pages_fts left over
+    # from the standalone layout keeps working for reads until
+    # migrate_pages_fts converts it; the triggers only fit the new table.
+    if _pages_fts_is_external(cursor) is not False:
+        cursor.execute(PAGES_FTS_TABLE_SQL)
+        cursor.executescript(PAGES_FTS_TRIGGERS_SQL)
+
     conn.commit()
-    conn.close()
+    if owns_conn:
+        conn.close()
 
 
 def run_migrations(db_path):
@@ -347,16 +485,11 @@ def seed_sample_data(db_path):
     for book_id, page_num, content in sample_pages:
         normalized = normalize_arabic(content)
 
+        # The pages_fts triggers index the row
         cursor.execute('''
             INSERT OR IGNORE INTO pages (book_id, page_num, content, content_normalized)
             VALUES (?, ?, ?, ?)
         ''', (book_id, page_num, content, normalized))
 
-        # Insert into FTS5 index
-        cursor.execute('''
-            INSERT OR IGNORE INTO pages_fts (book_id, page_num, content)
-            VALUES (?, ?, ?)
-        ''', (book_id, str(page_num), normalized))
-
     conn.commit()
     conn.close()
@@ -1,13 +1,126 @@
 """
 Granada v2 API Routes
 """
-from flask import Blueprint, jsonify, request, current_app
-from app.search import SearchEngine
-from app.models import get_db_connection
-from app.book_upload import BookUploader, BOOK_FORMAT_HELP
+import functools
+import http.client
+import io
+import itertools
+import json
+import os
+import re
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
+from app.search import SearchEngine, normalize_arabic
+from app.models import get_thread_connection
+from app.book_upload import BookUploader, BOOK_FORMAT_HELP, submit_upload, get_upload_status
+from app.dialogs import pick_path
 
 api_bp = Blueprint('api', __name__)
 
+# Largest page of books returned by GET /books?limit=...
+BOOKS_PAGE_MAX = 500
+
+# Characters of context kept on each side of an in-book search match
+SNIPPET_CONTEXT_CHARS = 50
+
+# TOC titles hidden from the reader: bare numbers like "1 -" or "123 -"
+# (hadith numbers, etc.) and page references like "[ص: 45]"
+_TOC_NUMBER_RE = re.compile(r'^\d+\s*-?\s*$')
+_TOC_PAGE_REF_RE = re.compile(r'^\[ص:\s*\d+\]$')
+
+# Exported note filenames: punctuation dropped, whitespace runs turned to "-"
+_SLUG_STRIP_RE = re.compile(r'[^\w\s\u0600-\u06FF]')
+_SLUG_SPACES_RE = re.compile(r'\s+')
+
+# Book and author columns the edit forms may change, in SQL column order
+_BOOK_EDITABLE_FIELDS = (
+    'title', 'subtitle', 'alt_title', 'subject', 'language',
+    'editor', 'edition', 'publisher', 'publication_place', 'publication_year', 'isbn',
+    'author_name', 'author_aka', 'author_born', 'death_date',
+    'volumes_count', 'page_count'
+)
+_AUTHOR_EDITABLE_FIELDS = ('name', 'death_date', 'bio')
+
+# Serialized /filters response with the FILTERS_EPOCH it was built at, as
+# one (epoch, payload) tuple so concurrent rebuilds can never mix the two
+filters_cache = {'entry': (-1, None)}
+
+# Serialized GET listings keyed by (path, query string), each stored
+# with the FILTERS_EPOCH it was built at; cleared whole when it fills up
+listing_cache = {}
+LISTING_CACHE_MAX = 256
+
+# Per-process ETag prefix so tags from before a restart never match
+_ETAG_PREFIX = os.urandom(4).hex()
+
+# Serializes FILTERS_EPOCH and progress_versions bumps; waitress runs
+# requests on several threads and two lost increments would collapse
+_epoch_lock = threading.Lock()
+
+# Per-book counters bumped by PUT /progress/<id>. Saving progress (on every
+# page turn) only changes that book's /progress response, so it leaves
+# FILTERS_EPOCH and the listings cached on it alone.
+progress_versions = {}
+
+# Length of the note excerpts shown in the notebook list
+NOTE_EXCERPT_CHARS = 80
+
+# Threads writing exported note files; file creation dominates the cost
+# (especially with on-access antivirus scanning) and releases the GIL
+NOTE_EXPORT_WRITERS = 8
+
+# Keep-alive HTTP(S) connections to the AI services, per worker thread
+_ai_connections = threading.local()
+
+# Model mapping for Ollama (UI name -> actual model name)
+OLLAMA_MODEL_MAP = {
+    'ollama-llama2': 'llama2:latest',
+    'ollama-llama3': 'llama3.2:latest',
+    'ollama-mistral': 'mistral:latest',
+    'ollama-deepseek': 'deepseek-r1:8b',
+}
+
+# Claude model mapping (UI name -> API model name)
+# Updated to Claude 4.5 family (2025)
+CLAUDE_MODEL_MAP = {
+    'claude-sonnet-4-5': 'claude-sonnet-4-5-20250929',
+    'claude-opus-4-5': 'claude-opus-4-5-20251101',
+    'claude-haiku-4-5': 'claude-haiku-4-5-20251001',
+}
+
+# Prompt sent to the AI services: the current book and page, then the question
+AI_CONTEXT_TEMPLATE = """أنت مساعد ذكي متخصص في الكتب العربية الإسلامية.
+الكتاب الحالي: {title}
+محتوى الصفحة الحالية:
+{content}
+
+سؤال المستخدم: {message}
+
+أجب باللغة العربية بشكل موجز ومفيد."""
+
+# The settings table as a dict with the FILTERS_EPOCH it was read at, as
+# one (epoch, settings) tuple so an overlapping save can never mix the two
+settings_cache = {'entry': (-1, None)}
+
+# Non-GET endpoints that never write to the database, so they leave
+# FILTERS_EPOCH (and everything cached on it) alone
+_READ_ONLY_ENDPOINTS = frozenset({
+    'api.ai_chat', 'api.browse_file', 'api.browse_folder', 'api.browse_export_folder',
+    # Only writes the scan's own file_cache of header previews
+    'api.scan_upload_folder'
+})
+
+# Non-GET endpoints that only write reading_progress, which no listing
+# cached on FILTERS_EPOCH reads; they bump progress_versions instead
+_PROGRESS_ENDPOINTS = frozenset({'api.update_progress'})
+
 
 def get_search_engine():
     """Get search engine instance."""
@@ -15,8 +128,8 @@ def get_search_engine():
 
 
 def get_db():
-    """Get database connection."""
-    return get_db_connection(current_app.config['DATABASE_PATH'])
+    """Get this thread's database connection (shared across requests)."""
+    return get_thread_connection(current_app.config['DATABASE_PATH'])
 
 
 def get_book_uploader():
@@ -24,6 +137,106 @@ def get_book_uploader():
     return BookUploader(current_app.config['DATABASE_PATH'])
 
 
+@api_bp.before_request
+def wait_for_startup():
+    """Hold API requests until background migrations and imports finish."""
+    startup_done = current_app.extensions.get('granada_startup')
+    if startup_done is not None:
+        startup_done.wait()
+
+
+@api_bp.teardown_request
+def release_db(exc=None):
+    """Roll back anything a request left uncommitted on the shared connection."""
+    conn = get_thread_connection(current_app.config['DATABASE_PATH'], create=False)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def _filters_invalidator():
+    """Callback that bumps FILTERS_EPOCH from outside the request."""
+    app = current_app._get_current_object()
+
+    def invalidate():
+        _advance_filters_epoch(app)
+    return invalidate
+
+
+def _advance_filters_epoch(app):
+    """Bump FILTERS_EPOCH, dropping everything cached on it."""
+    with _epoch_lock:
+        app.config['FILTERS_EPOCH'] = app.config.get('FILTERS_EPOCH', 0) + 1
+
+
+def _progress_version(book_id):
+    """Current progress_versions counter for book_id (cached_listing version)."""
+    return progress_versions.get(book_id, 0)
+
+
+def load_settings():
+    """All settings as a {key: value} dict, re-read only after a write request."""
+    # Read the epoch before querying so a concurrent write marks this stale
+    epoch = current_app.config.get('FILTERS_EPOCH', 0)
+    cached_epoch, settings = settings_cache['entry']
+    if cached_epoch != epoch:
+        cursor = get_db().execute('SELECT key, value FROM settings')
+        settings = {row['key']: row['value'] for row in cursor}
+        settings_cache['entry'] = (epoch, settings)
+    return settings
+
+
+@api_bp.after_request
+def bump_filters_epoch(response):
+    """Invalidate the cached /filters response after any write request."""
+    if (request.method != 'GET' and response.status_code < 400
+            and request.endpoint not in _READ_ONLY_ENDPOINTS
+            and request.endpoint not in _PROGRESS_ENDPOINTS):
+        _advance_filters_epoch(current_app)
+    return response
+
+
+def cached_listing(view=None, *, version=None):
+    """
+    Serve a read-only GET response from memory until the next write request.
+
+    Responses carry a weak ETag derived from FILTERS_EPOCH, so a client
+    revalidating an unchanged listing gets a 304 without touching the DB.
+    version, if given, is called with the view's arguments and returns a
+    counter for changes that do not bump FILTERS_EPOCH; it becomes part of
+    the epoch (e.g. @cached_listing(version=_progress_version)).
+    """
+    if view is None:
+        return functools.partial(cached_listing, version=version)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Read the epoch before querying so a concurrent write marks this stale
+        epoch = current_app.config.get('FILTERS_EPOCH', 0)
+        if version is not None:
+            epoch = f'{epoch}.{version(*args, **kwargs)}'
+        etag = f'{_ETAG_PREFIX}-{epoch}'
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+
+        key = (request.path, request.query_string)
+        cached = listing_cache.get(key)
+        if cached is not None and cached[0] == epoch:
+            response = Response(cached[1], mimetype='application/json')
+        else:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if len(listing_cache) >= LISTING_CACHE_MAX:
+                listing_cache.clear()
+            listing_cache[key] = (epoch, response.get_data())
+
+        response.set_etag(etag, weak=True)
+        return response
+    return wrapper
+
+
 # ============================================================================
 # FILTERS
 # ============================================================================
@@ -31,35 +244,35 @@ def get_book_uploader():
 @api_bp.route('/filters')
 def get_filters():
     """Get all filter options for search."""
+    # Read the epoch before querying so a concurrent write marks this stale
+    epoch = current_app.config.get('FILTERS_EPOCH', 0)
+    cached_epoch, payload = filters_cache['entry']
+    if cached_epoch == epoch:
+        return Response(payload, mimetype='application/json')
+
     conn = get_db()
     cursor = conn.cursor()
 
-    # Get books
-    cursor.execute('''
-        SELECT id, title FROM books WHERE is_downloaded = 1
-        ORDER BY title
-    ''')
-    books = [{'id': row['id'], 'title': row['title']} for row in cursor.fetchall()]
-
-    # Get authors
-    cursor.execute('''
-        SELECT id, name FROM authors ORDER BY death_date
-    ''')
-    authors = [{'id': row['id'], 'name': row['name']} for row in cursor.fetchall()]
-
-    # Get categories
+    # Fetch books, authors and categories in one round trip; the kind
+    # column routes each row, and sort_key keeps each list's own order
     cursor.execute('''
-        SELECT id, name FROM categories ORDER BY id
+        SELECT 'books' AS kind, id, title AS label, title AS sort_key
+        FROM books WHERE is_downloaded = 1
+        UNION ALL
+        SELECT 'authors', id, name, death_date FROM authors
+        UNION ALL
+        SELECT 'categories', id, name, id FROM categories
+        ORDER BY kind, sort_key
     ''')
-    categories = [{'id': row['id'], 'name': row['name']} for row in cursor.fetchall()]
 
-    conn.close()
+    filters = {'books': [], 'authors': [], 'categories': []}
+    for kind, item_id, label, _ in cursor:
+        label_key = 'title' if kind == 'books' else 'name'
+        filters[kind].append({'id': item_id, label_key: label})
 
-    return jsonify({
-        'books': books,
-        'authors': authors,
-        'categories': categories
-    })
+    response = jsonify(filters)
+    filters_cache['entry'] = (epoch, response.get_data())
+    return response
 
 
 # ============================================================================
@@ -121,16 +334,27 @@ def search_history():
 # ============================================================================
 
 @api_bp.route('/books')
+@cached_listing
 def get_books():
-    """Get all books in library."""
+    """
+    Get books in library, ordered by title.
+
+    Without `limit` the whole library is returned. With it, at most `limit`
+    books come back along with a `next_cursor` ({after_title, after_id}, or
+    None on the last page) to pass on the following request.
+    """
     downloaded = request.args.get('downloaded', None)
     owned = request.args.get('owned', None)
+    limit = request.args.get('limit', None, type=int)
+    after_title = request.args.get('after_title', None)
+    after_id = request.args.get('after_id', None)
 
     conn = get_db()
     cursor = conn.cursor()
 
     sql = '''
-        SELECT b.*, a.name as author_name, c.name as category_name
+        SELECT b.id, b.title, b.death_date, b.file_size, b.is_downloaded, b.is_owned,
+               a.name as author_name, c.name as category_name
         FROM books b
         LEFT JOIN authors a ON b.author_id = a.id
         LEFT JOIN categories c ON b.category_id = c.id
@@ -146,26 +370,43 @@ def get_books():
         sql += ' AND b.is_owned = ?'
         params.append(1 if owned == 'true' else 0)
 
-    sql += ' ORDER BY b.title'
+    if after_title is not None and after_id is not None:
+        sql += ' AND (b.title > ? OR (b.title = ? AND b.id > ?))'
+        params.extend([after_title, after_title, after_id])
+
+    sql += ' ORDER BY b.title, b.id'
 
+    if limit is not None:
+        limit = max(1, min(limit, BOOKS_PAGE_MAX))
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+    # Plain tuples for this cursor only: the listing can be the whole
+    # library, and positional access skips building a Row per book
+    cursor.row_factory = None
     cursor.execute(sql, params)
     rows = cursor.fetchall()
-    conn.close()
 
-    books = []
-    for row in rows:
-        books.append({
-            'id': row['id'],
-            'title': row['title'],
-            'author': row['author_name'],
-            'author_death': row['death_date'],
-            'category': row['category_name'],
-            'file_size': row['file_size'],
-            'is_downloaded': bool(row['is_downloaded']),
-            'is_owned': bool(row['is_owned'])
-        })
+    books = [{
+        'id': book_id,
+        'title': title,
+        'author': author_name,
+        'author_death': death_date,
+        'category': category_name,
+        'file_size': file_size,
+        'is_downloaded': bool(is_downloaded),
+        'is_owned': bool(is_owned)
+    } for (book_id, title, death_date, file_size, is_downloaded, is_owned,
+           author_name, category_name) in rows]
+
+    if limit is None:
+        return jsonify({'books': books})
 
-    return jsonify({'books': books})
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = {'after_title': rows[-1][1], 'after_id': rows[-1][0]}
+
+    return jsonify({'books': books, 'next_cursor': next_cursor})
 
 
 @api_bp.route('/books/<book_id>')
@@ -175,8 +416,9 @@ def get_book(book_id):
     cursor = conn.cursor()
 
     cursor.execute('''
-        SELECT b.*, a.name as author_name, a.bio as author_bio,
-               c.name as category_name,
+        SELECT b.id, b.title, b.author_id, b.death_date, b.category_id,
+               b.file_size, b.is_downloaded, b.is_owned, b.source,
+               a.name as author_name, c.name as category_name,
                (SELECT COUNT(*) FROM pages WHERE book_id = b.id) as total_pages
         FROM books b
         LEFT JOIN authors a ON b.author_id = a.id
@@ -185,7 +427,6 @@ def get_book(book_id):
     ''', (book_id,))
 
     row = cursor.fetchone()
-    conn.close()
 
     if not row:
         return jsonify({'error': 'Book not found'}), 404
@@ -228,7 +469,6 @@ def get_book_card(book_id):
     ''', (book_id,))
 
     row = cursor.fetchone()
-    conn.close()
 
     if not row:
         return jsonify({'error': 'Book not found'}), 404
@@ -290,10 +530,84 @@ def get_book_card(book_id):
     return jsonify(card)
 
 
+def _page_dict(row):
+    """Shape a pages row (page_num, volume, original_page, content) for the reader."""
+    return {
+        'page_num': row['page_num'],
+        'volume': row['volume'] if row['volume'] else 1,
+        'original_page': row['original_page'] if row['original_page'] else row['page_num'],
+        'content': row['content']
+    }
+
+
+# Page count of a book, as a scalar subquery so the page fetch can return
+# it in the same statement (SQLite evaluates it once per execute)
+_SQL_TOTAL_PAGES = '(SELECT MAX(page_num) FROM pages WHERE book_id = ?) AS total'
+
+
+def _total_pages(cursor, book_id, rows):
+    """Page count from fetched rows, querying it only if none came back."""
+    if rows:
+        total = rows[0]['total']
+    else:
+        cursor.execute('SELECT MAX(page_num) AS total FROM pages WHERE book_id = ?', (book_id,))
+        total = cursor.fetchone()['total']
+    return total if total else 1
+
+
+def _iter_json_object(fields):
+    """
+    Encode (key, value) pairs as one JSON object, piece by piece. A value
+    that is an iterator is written out as an array one item at a time, so
+    rows can go straight from a cursor onto the wire.
+    """
+    dumps = current_app.json.dumps
+    separator = '{'
+    for key, value in fields:
+        yield f'{separator}{dumps(key)}:'
+        separator = ','
+        if isinstance(value, Iterator):
+            yield '['
+            for i, item in enumerate(value):
+                yield (',' if i else '') + dumps(item)
+            yield ']'
+        else:
+            yield dumps(value)
+    yield '}' if separator == ',' else '{}'
+
+
+def _stream_pages(head, rows):
+    """
+    Stream a page range straight off the cursor instead of building it
+    in memory first.
+
+    The body is the usual JSON object with the pages under `pages`; a
+    client sending `Accept: application/x-ndjson` gets `head` on the
+    first line and one page per line after it instead.
+    """
+    dumps = current_app.json.dumps
+    ndjson = request.accept_mimetypes.best_match(
+        ['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+    def generate():
+        if ndjson:
+            yield dumps(head) + '\n'
+            for row in rows:
+                yield dumps(_page_dict(row)) + '\n'
+            return
+
+        yield from _iter_json_object([('pages', map(_page_dict, rows)), *head.items()])
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson' if ndjson else 'application/json')
+
+
 @api_bp.route('/books/<book_id>/pages')
 def get_book_pages(book_id):
-    """Get book page content. Supports single page or range query."""
-    # Check for range query (start/end) or single page query
+    """Get book page content. Supports single page, range or cursor query."""
+    # Check for cursor query, range query (start/end) or single page query
+    after_page = request.args.get('cursor', type=int)
+    limit = request.args.get('limit', 20, type=int)
     start = request.args.get('start', type=int)
     end = request.args.get('end', type=int)
     page_num = request.args.get('page', 1, type=int)
@@ -301,46 +615,56 @@ def get_book_pages(book_id):
     conn = get_db()
     cursor = conn.cursor()
 
-    # Get total page count
-    cursor.execute('''
-        SELECT MAX(page_num) as total FROM pages WHERE book_id = ?
-    ''', (book_id,))
-    total_row = cursor.fetchone()
-    total_pages = total_row['total'] if total_row and total_row['total'] else 1
-
-    # Range query for continuous scrolling
-    if start is not None and end is not None:
-        cursor.execute('''
-            SELECT page_num, volume, original_page, content FROM pages
-            WHERE book_id = ? AND page_num >= ? AND page_num <= ?
+    # Each branch reads the total page count alongside its pages
+    # Cursor query for continuous scrolling: the next `limit` pages after
+    # the last one the client has, seeked through idx_pages_book_page
+    if after_page is not None:
+        cursor.execute(f'''
+            SELECT page_num, volume, original_page, content, {_SQL_TOTAL_PAGES}
+            FROM pages
+            WHERE book_id = ? AND page_num > ?
             ORDER BY page_num
-        ''', (book_id, start, end))
-
-        pages = [{
-            'page_num': row['page_num'],
-            'volume': row['volume'] if row['volume'] else 1,
-            'original_page': row['original_page'] if row['original_page'] else row['page_num'],
-            'content': row['content']
-        } for row in cursor.fetchall()]
+            LIMIT ?
+        ''', (book_id, book_id, after_page, max(1, min(limit, 200))))
+        rows = cursor.fetchall()
 
-        conn.close()
+        pages = [_page_dict(row) for row in rows]
+        total_pages = _total_pages(cursor, book_id, rows)
 
         return jsonify({
             'book_id': book_id,
             'pages': pages,
             'total_pages': total_pages,
+            'next_cursor': pages[-1]['page_num'] if pages else None
+        })
+
+    # Range query for continuous scrolling
+    if start is not None and end is not None:
+        cursor.execute(f'''
+            SELECT page_num, volume, original_page, content, {_SQL_TOTAL_PAGES}
+            FROM pages
+            WHERE book_id = ? AND page_num >= ? AND page_num <= ?
+            ORDER BY page_num
+        ''', (book_id, book_id, start, end))
+        first = cursor.fetchone()
+        rows = [first] if first else []
+
+        return _stream_pages({
+            'book_id': book_id,
+            'total_pages': _total_pages(cursor, book_id, rows),
             'start': start,
             'end': end
-        })
+        }, itertools.chain(rows, cursor))
 
     # Single page query (legacy support)
-    cursor.execute('''
-        SELECT volume, original_page, content FROM pages
+    cursor.execute(f'''
+        SELECT volume, original_page, content, {_SQL_TOTAL_PAGES}
+        FROM pages
         WHERE book_id = ? AND page_num = ?
-    ''', (book_id, page_num))
+    ''', (book_id, book_id, page_num))
 
     row = cursor.fetchone()
-    conn.close()
+    total_pages = _total_pages(cursor, book_id, [row] if row else [])
 
     content = row['content'] if row else 'لم يتم العثور على المحتوى'
     volume = row['volume'] if row and row['volume'] else 1
@@ -361,38 +685,34 @@ def get_book_pages(book_id):
 @api_bp.route('/books/<book_id>/toc')
 def get_book_toc(book_id):
     """Get table of contents for a book."""
-    import re
-
     conn = get_db()
     cursor = conn.cursor()
 
-    # Get TOC entries from database
+    # Get TOC entries from database; SQLite's trim() only strips spaces, so
+    # this drops a subset of the short titles rejected below
     cursor.execute('''
         SELECT title, level, page_num, position
         FROM toc_entries
-        WHERE book_id = ?
+        WHERE book_id = ? AND length(trim(title)) >= 3
         ORDER BY position
     ''', (book_id,))
 
+    # Iterate the cursor rather than fetchall() so SQLite stops stepping
+    # (walking idx_toc_book_pos in order) once the 500-entry cap is reached
     toc = []
-    # Pattern to skip: entries that are just numbers like "1 -", "123 -", etc.
-    skip_pattern = re.compile(r'^\d+\s*-?\s*$')
-    # Pattern to skip: page references like "[ص: 45]"
-    page_ref_pattern = re.compile(r'^\[ص:\s*\d+\]$')
-
-    for row in cursor.fetchall():
+    for row in cursor:
         title = row['title']
 
-        # Skip numeric-only entries (hadith numbers, etc.)
-        if skip_pattern.match(title):
+        # Skip very short titles (cheapest check first)
+        if len(title.strip()) < 3:
             continue
 
-        # Skip page reference entries
-        if page_ref_pattern.match(title):
+        # Skip numeric-only entries (hadith numbers, etc.)
+        if _TOC_NUMBER_RE.match(title):
             continue
 
-        # Skip very short titles
-        if len(title.strip()) < 3:
+        # Skip page reference entries
+        if _TOC_PAGE_REF_RE.match(title):
             continue
 
         toc.append({
@@ -407,8 +727,6 @@ def get_book_toc(book_id):
         if len(toc) >= 500:
             break
 
-    conn.close()
-
     return jsonify({
         'toc': toc,
         'count': len(toc)
@@ -427,50 +745,51 @@ def search_in_book(book_id):
     conn = get_db()
     cursor = conn.cursor()
 
-    # Use FTS5 search within this book
-    from app.search import normalize_arabic
     normalized_query = normalize_arabic(query)
 
+    # Locate the match and cut the snippet window in SQL so only ~100
+    # characters per hit cross into Python. A verbatim hit is looked for
+    # in content; failing that, the stored content_normalized position
+    # is used, so pages are never normalized at request time.
     cursor.execute('''
-        SELECT page_num, content FROM pages
-        WHERE book_id = ? AND content_normalized LIKE ?
-        ORDER BY page_num
-        LIMIT ?
-    ''', (book_id, f'%{normalized_query}%', limit))
+        SELECT page_num, hit, content_length,
+               CASE WHEN hit > 0
+                    THEN substr(content, max(1, hit - ?), hit + ? - max(1, hit - ?))
+                    ELSE substr(content, 1, 100) END AS snippet
+        FROM (
+            SELECT page_num, content, length(content) AS content_length,
+                   coalesce(nullif(instr(lower(content), lower(?)), 0),
+                            instr(content_normalized, ?)) AS hit
+            FROM pages
+            WHERE book_id = ? AND content_normalized LIKE ?
+            ORDER BY page_num
+            LIMIT ?
+        )
+    ''', (SNIPPET_CONTEXT_CHARS, len(query) + SNIPPET_CONTEXT_CHARS, SNIPPET_CONTEXT_CHARS,
+          query, normalized_query, book_id, f'%{normalized_query}%', limit))
 
     results = []
-    for row in cursor.fetchall():
-        content = row['content']
+    for row in cursor:
         page_num = row['page_num']
+        snippet = row['snippet']
 
         # Create snippet with highlight
-        idx = content.lower().find(query.lower())
-        if idx == -1:
-            # Try normalized search
-            from app.search import normalize_arabic
-            norm_content = normalize_arabic(content)
-            idx = norm_content.find(normalized_query)
-
+        idx = row['hit'] - 1
         if idx >= 0:
-            start = max(0, idx - 50)
-            end = min(len(content), idx + len(query) + 50)
-            snippet = content[start:end]
-            if start > 0:
+            if idx > SNIPPET_CONTEXT_CHARS:
                 snippet = '...' + snippet
-            if end < len(content):
+            if idx + len(query) + SNIPPET_CONTEXT_CHARS < row['content_length']:
                 snippet = snippet + '...'
             # Highlight the match
             snippet = snippet.replace(query, f'<mark>{query}</mark>')
         else:
-            snippet = content[:100] + '...'
+            snippet = snippet + '...'
 
         results.append({
             'page': page_num,
             'snippet': snippet
         })
 
-    conn.close()
-
     return jsonify({
         'results': results,
         'total': len(results),
@@ -494,15 +813,13 @@ def delete_book(book_id):
     conn = get_db()
     cursor = conn.cursor()
 
-    # Delete pages
+    # Delete pages (the pages_fts triggers drop their index entries)
     cursor.execute('DELETE FROM pages WHERE book_id = ?', (book_id,))
-    cursor.execute('DELETE FROM pages_fts WHERE book_id = ?', (book_id,))
 
     # Mark book as not downloaded
     cursor.execute('UPDATE books SET is_downloaded = 0 WHERE id = ?', (book_id,))
 
     conn.commit()
-    conn.close()
 
     return jsonify({
         'status': 'success',
@@ -510,6 +827,18 @@ def delete_book(book_id):
     })
 
 
+@functools.lru_cache(maxsize=256)
+def _update_sql(table, fields):
+    """
+    UPDATE statement for one table and set of whitelisted columns.
+
+    The same field set always yields the same string, so the connection's
+    statement cache reuses the prepared statement across requests.
+    """
+    assignments = ', '.join(f'{field} = ?' for field in fields)
+    return f'UPDATE {table} SET {assignments} WHERE id = ?'
+
+
 @api_bp.route('/books/<book_id>', methods=['PUT'])
 def update_book(book_id):
     """Update book metadata."""
@@ -518,33 +847,20 @@ def update_book(book_id):
     conn = get_db()
     cursor = conn.cursor()
 
-    # Check if book exists
-    cursor.execute('SELECT id FROM books WHERE id = ?', (book_id,))
-    if not cursor.fetchone():
-        conn.close()
-        return jsonify({'error': 'الكتاب غير موجود'}), 404
-
-    # Build update query dynamically based on provided fields
-    allowed_fields = [
-        'title', 'subtitle', 'alt_title', 'subject', 'language',
-        'editor', 'edition', 'publisher', 'publication_place', 'publication_year', 'isbn',
-        'author_name', 'author_aka', 'author_born', 'death_date',
-        'volumes_count', 'page_count'
-    ]
-
-    updates = []
-    params = []
-    for field in allowed_fields:
-        if field in data:
-            updates.append(f'{field} = ?')
-            params.append(data[field])
-
-    if updates:
-        params.append(book_id)
-        cursor.execute(f'UPDATE books SET {", ".join(updates)} WHERE id = ?', params)
+    # Update only the provided fields; the UPDATE's row count doubles as
+    # the existence check, which needs its own query only when it's empty
+    fields = tuple(field for field in _BOOK_EDITABLE_FIELDS if field in data)
+    if fields:
+        cursor.execute(_update_sql('books', fields),
+                       [data[field] for field in fields] + [book_id])
+        found = cursor.rowcount > 0
         conn.commit()
+    else:
+        cursor.execute('SELECT 1 FROM books WHERE id = ?', (book_id,))
+        found = cursor.fetchone() is not None
 
-    conn.close()
+    if not found:
+        return jsonify({'error': 'الكتاب غير موجود'}), 404
 
     return jsonify({'status': 'success', 'message': 'تم تحديث الكتاب'})
 
@@ -564,7 +880,6 @@ def update_book_ownership(book_id):
     )
 
     conn.commit()
-    conn.close()
 
     return jsonify({
         'status': 'success',
@@ -577,6 +892,7 @@ def update_book_ownership(book_id):
 # ============================================================================
 
 @api_bp.route('/authors')
+@cached_listing
 def get_authors():
     """Get all authors."""
     search_term = request.args.get('search', '')
@@ -584,10 +900,12 @@ def get_authors():
     conn = get_db()
     cursor = conn.cursor()
 
+    # Walk authors in idx_authors_death order and count each one's books
+    # with a probe on idx_books_author instead of joining and grouping
     sql = '''
-        SELECT a.*, COUNT(b.id) as book_count
+        SELECT a.*,
+               (SELECT COUNT(*) FROM books b WHERE b.author_id = a.id) as book_count
         FROM authors a
-        LEFT JOIN books b ON a.id = b.author_id
     '''
     params = []
 
@@ -595,11 +913,10 @@ def get_authors():
         sql += ' WHERE a.name LIKE ?'
         params.append(f'%{search_term}%')
 
-    sql += ' GROUP BY a.id ORDER BY a.death_date'
+    sql += ' ORDER BY a.death_date, a.id'
 
     cursor.execute(sql, params)
     rows = cursor.fetchall()
-    conn.close()
 
     authors = [{
         'id': row['id'],
@@ -621,15 +938,12 @@ def get_author(author_id):
     author = cursor.fetchone()
 
     if not author:
-        conn.close()
         return jsonify({'error': 'Author not found'}), 404
 
     cursor.execute('''
         SELECT id, title FROM books WHERE author_id = ?
     ''', (author_id,))
-    books = [{'id': row['id'], 'title': row['title']} for row in cursor.fetchall()]
-
-    conn.close()
+    books = [{'id': row['id'], 'title': row['title']} for row in cursor]
 
     return jsonify({
         'id': author['id'],
@@ -648,32 +962,20 @@ def update_author(author_id):
     conn = get_db()
     cursor = conn.cursor()
 
-    # Check if author exists
-    cursor.execute('SELECT id FROM authors WHERE id = ?', (author_id,))
-    if not cursor.fetchone():
-        conn.close()
-        return jsonify({'error': 'المؤلف غير موجود'}), 404
-
-    # Build update query
-    updates = []
-    params = []
-
-    if 'name' in data:
-        updates.append('name = ?')
-        params.append(data['name'])
-    if 'death_date' in data:
-        updates.append('death_date = ?')
-        params.append(data['death_date'])
-    if 'bio' in data:
-        updates.append('bio = ?')
-        params.append(data['bio'])
-
-    if updates:
-        params.append(author_id)
-        cursor.execute(f'UPDATE authors SET {", ".join(updates)} WHERE id = ?', params)
+    # Update only the provided fields; the UPDATE's row count doubles as
+    # the existence check, which needs its own query only when it's empty
+    fields = tuple(field for field in _AUTHOR_EDITABLE_FIELDS if field in data)
+    if fields:
+        cursor.execute(_update_sql('authors', fields),
+                       [data[field] for field in fields] + [author_id])
+        found = cursor.rowcount > 0
         conn.commit()
+    else:
+        cursor.execute('SELECT 1 FROM authors WHERE id = ?', (author_id,))
+        found = cursor.fetchone() is not None
 
-    conn.close()
+    if not found:
+        return jsonify({'error': 'المؤلف غير موجود'}), 404
 
     return jsonify({'status': 'success', 'message': 'تم تحديث المؤلف'})
 
@@ -687,35 +989,26 @@ def delete_author(author_id):
     conn = get_db()
     cursor = conn.cursor()
 
-    # Check if author exists
-    cursor.execute('SELECT id, name FROM authors WHERE id = ?', (author_id,))
-    author = cursor.fetchone()
-    if not author:
-        conn.close()
+    # Delete the author; no row deleted means it didn't exist
+    cursor.execute('DELETE FROM authors WHERE id = ?', (author_id,))
+    if cursor.rowcount == 0:
+        conn.rollback()
         return jsonify({'error': 'المؤلف غير موجود'}), 404
 
-    # Get books by this author
-    cursor.execute('SELECT id FROM books WHERE author_id = ?', (author_id,))
-    book_ids = [row['id'] for row in cursor.fetchall()]
-
-    if book_ids:
-        if reassign_to:
-            # Reassign books to another author
-            cursor.execute('UPDATE books SET author_id = ? WHERE author_id = ?', (reassign_to, author_id))
-        else:
-            # Set author_id to NULL for orphaned books
-            cursor.execute('UPDATE books SET author_id = NULL WHERE author_id = ?', (author_id,))
-
-    # Delete the author
-    cursor.execute('DELETE FROM authors WHERE id = ?', (author_id,))
+    if reassign_to:
+        # Reassign books to another author
+        cursor.execute('UPDATE books SET author_id = ? WHERE author_id = ?', (reassign_to, author_id))
+    else:
+        # Set author_id to NULL for orphaned books
+        cursor.execute('UPDATE books SET author_id = NULL WHERE author_id = ?', (author_id,))
+    books_affected = cursor.rowcount
 
     conn.commit()
-    conn.close()
 
     return jsonify({
         'status': 'success',
         'message': 'تم حذف المؤلف',
-        'books_affected': len(book_ids)
+        'books_affected': books_affected
     })
 
 
@@ -724,40 +1017,36 @@ def delete_author(author_id):
 # ============================================================================
 
 @api_bp.route('/categories')
+@cached_listing
 def get_categories():
     """Get all categories."""
     conn = get_db()
     cursor = conn.cursor()
 
+    # Built-in and custom categories in one round trip; each count is a
+    # probe on idx_books_category / idx_book_custom_categories_category
     cursor.execute('''
-        SELECT c.id, c.name, COUNT(b.id) as book_count
+        SELECT 0 AS is_custom, c.id, c.name,
+               (SELECT COUNT(*) FROM books b
+                WHERE b.category_id = c.id AND b.is_downloaded = 1) AS book_count,
+               NULL AS created_at
         FROM categories c
-        LEFT JOIN books b ON c.id = b.category_id AND b.is_downloaded = 1
-        GROUP BY c.id
-        ORDER BY c.id
-    ''')
-    categories = [{
-        'id': row['id'],
-        'name': row['name'],
-        'book_count': row['book_count']
-    } for row in cursor.fetchall()]
-
-    # Get custom categories with book counts
-    cursor.execute('''
-        SELECT cc.id, cc.name, COUNT(bcc.book_id) as book_count
+        UNION ALL
+        SELECT 1, cc.id, cc.name,
+               (SELECT COUNT(*) FROM book_custom_categories bcc
+                WHERE bcc.category_id = cc.id),
+               cc.created_at
         FROM custom_categories cc
-        LEFT JOIN book_custom_categories bcc ON cc.id = bcc.category_id
-        LEFT JOIN books b ON bcc.book_id = b.id AND b.is_downloaded = 1
-        GROUP BY cc.id
-        ORDER BY cc.created_at DESC
+        ORDER BY is_custom, created_at DESC, id
     ''')
-    custom = [{
-        'id': row['id'],
-        'name': row['name'],
-        'book_count': row['book_count']
-    } for row in cursor.fetchall()]
 
-    conn.close()
+    categories, custom = [], []
+    for is_custom, category_id, name, book_count, _ in cursor:
+        (custom if is_custom else categories).append({
+            'id': category_id,
+            'name': name,
+            'book_count': book_count
+        })
 
     return jsonify({
         'categories': categories,
@@ -784,7 +1073,6 @@ def create_category():
     cursor.execute('SELECT id FROM custom_categories WHERE name = ?', (name,))
     existing = cursor.fetchone()
     if existing:
-        conn.close()
         return jsonify({
             'status': 'exists',
             'message': 'Category already exists',
@@ -798,7 +1086,6 @@ def create_category():
     )
     category_id = cursor.lastrowid
     conn.commit()
-    conn.close()
 
     return jsonify({
         'status': 'success',
@@ -821,16 +1108,12 @@ def update_category(category_id):
     conn = get_db()
     cursor = conn.cursor()
 
-    # Check if it's a custom category
-    cursor.execute('SELECT id FROM custom_categories WHERE id = ?', (category_id,))
-    if not cursor.fetchone():
-        conn.close()
-        return jsonify({'status': 'error', 'message': 'Category not found or cannot be edited'}), 404
-
-    # Update the category
+    # Update the category; only custom categories can be renamed
     cursor.execute('UPDATE custom_categories SET name = ? WHERE id = ?', (name, category_id))
+    if cursor.rowcount == 0:
+        conn.rollback()
+        return jsonify({'status': 'error', 'message': 'Category not found or cannot be edited'}), 404
     conn.commit()
-    conn.close()
 
     return jsonify({'status': 'success'})
 
@@ -845,16 +1128,20 @@ def delete_category(category_id):
     conn = get_db()
     cursor = conn.cursor()
 
+    # Take the write lock before reading the category's books so the
+    # lookup and the cascade below are one transaction with one commit
+    cursor.execute('BEGIN IMMEDIATE')
+
     # Check if it's a custom category
     cursor.execute('SELECT id, name FROM custom_categories WHERE id = ?', (category_id,))
     category = cursor.fetchone()
     if not category:
-        conn.close()
+        conn.rollback()
         return jsonify({'status': 'error', 'message': 'Category not found or cannot be deleted'}), 404
 
     # Get books in this category (using book_custom_categories association)
     cursor.execute('SELECT book_id FROM book_custom_categories WHERE category_id = ?', (category_id,))
-    book_ids = [row['book_id'] for row in cursor.fetchall()]
+    book_ids = [row['book_id'] for row in cursor]
 
     if book_ids:
         if action == 'transfer' and transfer_to:
@@ -864,11 +1151,10 @@ def delete_category(category_id):
 
             if is_custom:
                 # Transfer to another custom category
-                for book_id in book_ids:
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO book_custom_categories (book_id, category_id)
-                        VALUES (?, ?)
-                    ''', (book_id, target_id))
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO book_custom_categories (book_id, category_id)
+                    VALUES (?, ?)
+                ''', [(book_id, target_id) for book_id in book_ids])
             else:
                 # Transfer to a main category (update books.category_id)
                 cursor.execute('''
@@ -876,14 +1162,11 @@ def delete_category(category_id):
                 '''.format(','.join('?' * len(book_ids))), [target_id] + book_ids)
 
         elif action == 'delete':
-            # Delete all books in this category
-            for book_id in book_ids:
-                # Delete pages first
-                cursor.execute('DELETE FROM pages WHERE book_id = ?', (book_id,))
-                # Delete from search index
-                cursor.execute('DELETE FROM books_fts WHERE book_id = ?', (book_id,))
-                # Delete the book
-                cursor.execute('DELETE FROM books WHERE id = ?', (book_id,))
+            # Delete all books in this category: pages first (the pages_fts
+            # triggers drop their index entries), then the books
+            placeholders = ','.join('?' * len(book_ids))
+            cursor.execute(f'DELETE FROM pages WHERE book_id IN ({placeholders})', book_ids)
+            cursor.execute(f'DELETE FROM books WHERE id IN ({placeholders})', book_ids)
 
     # Remove all book associations for this category
     cursor.execute('DELETE FROM book_custom_categories WHERE category_id = ?', (category_id,))
@@ -892,7 +1175,6 @@ def delete_category(category_id):
     cursor.execute('DELETE FROM custom_categories WHERE id = ?', (category_id,))
 
     conn.commit()
-    conn.close()
 
     return jsonify({'status': 'success'})
 
@@ -907,7 +1189,6 @@ def get_category_books(category_id):
     category = cursor.fetchone()
 
     if not category:
-        conn.close()
         return jsonify({'error': 'Category not found'}), 404
 
     cursor.execute('''
@@ -917,9 +1198,7 @@ def get_category_books(category_id):
         WHERE b.category_id = ?
     ''', (category_id,))
     books = [{'id': row['id'], 'title': row['title'], 'author': row['author']}
-             for row in cursor.fetchall()]
-
-    conn.close()
+             for row in cursor]
 
     return jsonify({
         'category': {'id': category['id'], 'name': category['name']},
@@ -937,55 +1216,57 @@ def get_collections():
     conn = get_db()
     cursor = conn.cursor()
 
-    cursor.execute('SELECT * FROM collections ORDER BY created_at DESC')
-    collections_data = []
+    # One query for every collection and its books; collections without
+    # books still come back (with NULL book columns) via the LEFT JOIN
+    cursor.execute('''
+        SELECT c.id AS coll_id, c.name AS coll_name,
+               b.id, b.title, rp.current_page, rp.total_pages, rp.is_complete
+        FROM collections c
+        LEFT JOIN (collection_books cb JOIN books b ON cb.book_id = b.id)
+            ON cb.collection_id = c.id
+        LEFT JOIN reading_progress rp ON b.id = rp.book_id
+        ORDER BY c.created_at DESC, c.id, cb.position
+    ''')
 
-    for coll in cursor.fetchall():
-        # Get books in this collection
-        cursor.execute('''
-            SELECT b.id, b.title, rp.current_page, rp.total_pages, rp.is_complete
-            FROM collection_books cb
-            JOIN books b ON cb.book_id = b.id
-            LEFT JOIN reading_progress rp ON b.id = rp.book_id
-            WHERE cb.collection_id = ?
-            ORDER BY cb.position
-        ''', (coll['id'],))
-
-        books = []
-        total_progress = 0
-        for book in cursor.fetchall():
-            current = book['current_page'] or 1
-            total = book['total_pages'] or 1
-            is_complete = bool(book['is_complete'])
-
-            books.append({
-                'id': book['id'],
-                'title': book['title'],
-                'progress': {
-                    'current_page': current,
-                    'total_pages': total,
-                    'is_complete': is_complete
-                }
-            })
-
-            if is_complete:
-                total_progress += 1
-            elif total > 0:
-                total_progress += current / total
+    # coll_id -> [name, books, total_progress], in first-seen order
+    grouped = {}
+    for book in cursor:
+        entry = grouped.setdefault(book['coll_id'], [book['coll_name'], [], 0])
+        if book['id'] is None:
+            continue
+
+        current = book['current_page'] or 1
+        total = book['total_pages'] or 1
+        is_complete = bool(book['is_complete'])
+
+        entry[1].append({
+            'id': book['id'],
+            'title': book['title'],
+            'progress': {
+                'current_page': current,
+                'total_pages': total,
+                'is_complete': is_complete
+            }
+        })
+
+        if is_complete:
+            entry[2] += 1
+        elif total > 0:
+            entry[2] += current / total
 
+    collections_data = []
+    for coll_id, (name, books, total_progress) in grouped.items():
         book_count = len(books)
         overall_progress = total_progress / book_count if book_count > 0 else 0
 
         collections_data.append({
-            'id': coll['id'],
-            'name': coll['name'],
+            'id': coll_id,
+            'name': name,
             'book_count': book_count,
             'progress': round(overall_progress, 2),
             'books': books
         })
 
-    conn.close()
-
     return jsonify({'collections': collections_data})
 
 
@@ -1005,7 +1286,6 @@ def create_collection():
     collection_id = cursor.lastrowid
 
     conn.commit()
-    conn.close()
 
     return jsonify({
         'id': collection_id,
@@ -1025,7 +1305,6 @@ def update_collection(collection_id):
 
     cursor.execute('UPDATE collections SET name = ? WHERE id = ?', (name, collection_id))
     conn.commit()
-    conn.close()
 
     return jsonify({'status': 'success'})
 
@@ -1040,7 +1319,6 @@ def delete_collection(collection_id):
     cursor.execute('DELETE FROM collections WHERE id = ?', (collection_id,))
 
     conn.commit()
-    conn.close()
 
     return jsonify({'status': 'success'})
 
@@ -1070,7 +1348,6 @@ def add_book_to_collection(collection_id):
     ''', (collection_id, book_id, next_pos))
 
     conn.commit()
-    conn.close()
 
     return jsonify({'status': 'success'})
 
@@ -1086,7 +1363,6 @@ def remove_book_from_collection(collection_id, book_id):
     ''', (collection_id, book_id))
 
     conn.commit()
-    conn.close()
 
     return jsonify({'status': 'success'})
 
@@ -1096,6 +1372,7 @@ def remove_book_from_collection(collection_id, book_id):
 # ============================================================================
 
 @api_bp.route('/progress/<book_id>')
+@cached_listing(version=_progress_version)
 def get_progress(book_id):
     """Get reading progress for a book."""
     conn = get_db()
@@ -1103,7 +1380,6 @@ def get_progress(book_id):
 
     cursor.execute('SELECT * FROM reading_progress WHERE book_id = ?', (book_id,))
     row = cursor.fetchone()
-    conn.close()
 
     if not row:
         return jsonify({
@@ -1152,7 +1428,10 @@ def update_progress(book_id):
     ''', (book_id, current_page, total_pages, 1 if is_complete else 0))
 
     conn.commit()
-    conn.close()
+
+    # Only this book's /progress response changed (see _PROGRESS_ENDPOINTS)
+    with _epoch_lock:
+        progress_versions[book_id] = progress_versions.get(book_id, 0) + 1
 
     return jsonify({'status': 'success'})
 
@@ -1162,16 +1441,10 @@ def update_progress(book_id):
 # ============================================================================
 
 @api_bp.route('/settings')
+@cached_listing
 def get_settings():
     """Get application settings."""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT key, value FROM settings')
-    rows = cursor.fetchall()
-    conn.close()
-
-    settings = {row['key']: row['value'] for row in rows}
+    settings = load_settings()
 
     # Return with defaults
     return jsonify({
@@ -1202,7 +1475,6 @@ def update_settings():
         ''', (key, str(value)))
 
     conn.commit()
-    conn.close()
 
     return jsonify({'status': 'success'})
 
@@ -1231,13 +1503,11 @@ def upload_book_file():
     if not file_path:
         return jsonify({'status': 'error', 'message': 'مسار الملف مطلوب'}), 400
 
-    uploader = get_book_uploader()
-    result = uploader.upload_file(file_path, category_id, is_custom, override_metadata)
-
-    if result['status'] == 'error':
-        return jsonify(result), 400
+    job_id = submit_upload(current_app.config['DATABASE_PATH'], 'upload_file',
+                           (file_path, category_id, is_custom, override_metadata),
+                           file_path, _filters_invalidator())
 
-    return jsonify(result)
+    return jsonify({'status': 'queued', 'job_id': job_id}), 202
 
 
 @api_bp.route('/upload/folder', methods=['POST'])
@@ -1252,8 +1522,23 @@ def upload_book_folder():
     if not folder_path:
         return jsonify({'status': 'error', 'message': 'مسار المجلد مطلوب'}), 400
 
-    uploader = get_book_uploader()
-    result = uploader.upload_folder(folder_path, category_id, is_custom, auto_assign)
+    job_id = submit_upload(current_app.config['DATABASE_PATH'], 'upload_folder',
+                           (folder_path, category_id, is_custom, auto_assign),
+                           folder_path, _filters_invalidator())
+
+    return jsonify({'status': 'queued', 'job_id': job_id}), 202
+
+
+@api_bp.route('/upload/status/<int:job_id>')
+def upload_status(job_id):
+    """Get the status of a queued upload, or its result once finished."""
+    result = get_upload_status(current_app.config['DATABASE_PATH'], job_id)
+
+    if result is None:
+        return jsonify({'status': 'error', 'message': 'عملية الرفع غير موجودة'}), 404
+
+    if result['status'] == 'error':
+        return jsonify(result), 400
 
     return jsonify(result)
 
@@ -1283,16 +1568,8 @@ def get_format_help():
 def browse_file():
     """Open native file picker dialog."""
     try:
-        import tkinter as tk
-        from tkinter import filedialog
-
-        # Create hidden root window
-        root = tk.Tk()
-        root.withdraw()
-        root.attributes('-topmost', True)
-
-        # Open file dialog
-        file_path = filedialog.askopenfilename(
+        file_path = pick_path(
+            'file',
             title='اختر ملف كتاب',
             filetypes=[
                 ('Text files', '*.txt'),
@@ -1301,8 +1578,6 @@ def browse_file():
             ]
         )
 
-        root.destroy()
-
         if file_path:
             return jsonify({'status': 'success', 'path': file_path})
         else:
@@ -1316,20 +1591,7 @@ def browse_file():
 def browse_folder():
     """Open native folder picker dialog."""
     try:
-        import tkinter as tk
-        from tkinter import filedialog
-
-        # Create hidden root window
-        root = tk.Tk()
-        root.withdraw()
-        root.attributes('-topmost', True)
-
-        # Open folder dialog
-        folder_path = filedialog.askdirectory(
-            title='اختر مجلد الكتب'
-        )
-
-        root.destroy()
+        folder_path = pick_path('folder', title='اختر مجلد الكتب')
 
         if folder_path:
             return jsonify({'status': 'success', 'path': folder_path})
@@ -1344,12 +1606,144 @@ def browse_folder():
 # AI CHAT
 # ============================================================================
 
+def _post_json(url, payload, headers, timeout, stream=False):
+    """
+    POST a JSON payload and return the decoded JSON reply.
+
+    The connection to the host is kept open and reused by the next call
+    on this thread, so a chat session pays for the TLS handshake once.
+    Errors are raised as the urllib.error exceptions urlopen would raise.
+    With a proxy configured the request goes through urlopen instead.
+
+    With `stream` set, a successful reply is returned undecoded as an
+    iterator over its lines, read off the socket as they arrive.
+    """
+    body = json.dumps(payload).encode('utf-8')
+    parts = urllib.parse.urlsplit(url)
+    if urllib.request.getproxies().get(parts.scheme):
+        req = urllib.request.Request(url, data=body, headers=headers, method='POST')
+        response = urllib.request.urlopen(req, timeout=timeout)
+        if stream:
+            return _iter_reply_lines(response, response, None, None)
+        with response:
+            return json.loads(response.read().decode('utf-8'))
+
+    connections = getattr(_ai_connections, 'by_host', None)
+    if connections is None:
+        connections = _ai_connections.by_host = {}
+    key = (parts.scheme, parts.netloc)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    while True:
+        conn = connections.pop(key, None)
+        reused = conn is not None
+        if conn is None:
+            conn_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                          else http.client.HTTPConnection)
+            conn = conn_class(parts.netloc, timeout=timeout)
+        elif conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+        try:
+            conn.request('POST', path, body=body, headers=headers)
+            response = conn.getresponse()
+            if stream and response.status < 400:
+                return _iter_reply_lines(response, conn, connections, key)
+            data = response.read()
+        except (ConnectionResetError, BrokenPipeError) as e:
+            conn.close()
+            if reused:
+                # The server dropped the idle connection; retry on a new one
+                continue
+            raise urllib.error.URLError(e)
+        except OSError as e:
+            conn.close()
+            raise urllib.error.URLError(e)
+        except http.client.HTTPException:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            connections[key] = conn
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason,
+                                         response.headers, io.BytesIO(data))
+        return json.loads(data.decode('utf-8'))
+
+
+def _iter_reply_lines(response, conn, connections, key):
+    """
+    Yield a streamed reply line by line, then hand its connection back to
+    `connections` for reuse. A reply abandoned halfway closes it instead.
+    """
+    finished = False
+    try:
+        for line in response:
+            yield line
+        finished = True
+    except OSError as e:
+        raise urllib.error.URLError(e)
+    finally:
+        if finished and connections is not None and not response.will_close:
+            connections[key] = conn
+        else:
+            conn.close()
+
+
+def _ollama_reply_text(lines):
+    """Pull the reply text out of Ollama's streamed NDJSON chunks."""
+    for line in lines:
+        if not line.strip():
+            continue
+        chunk = json.loads(line)
+        if chunk.get('error'):
+            raise RuntimeError(f'Ollama error: {chunk["error"]}')
+        yield chunk.get('response', '')
+
+
+def _claude_reply_text(lines):
+    """Pull the reply text out of the Claude API's server-sent events."""
+    for line in lines:
+        if not line.startswith(b'data:'):
+            continue
+        event = json.loads(line[5:])
+        if event.get('type') == 'content_block_delta':
+            yield event.get('delta', {}).get('text', '')
+        elif event.get('type') == 'error':
+            raise RuntimeError(f'Claude error: {event.get("error", {}).get("message", "")}')
+
+
+def _stream_ai_reply(chunks):
+    """
+    Forward reply text to the browser as server-sent events as soon as
+    each piece arrives. A failure after the reply has started is sent as
+    a final event carrying `error`, since the status is already out.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        try:
+            for text in chunks:
+                if text:
+                    yield f'data: {dumps({"response": text})}\n\n'
+        except Exception as e:
+            message = f'فشل الاتصال بخدمة الذكاء الاصطناعي: {str(e)}'
+            yield f'data: {dumps({"error": message})}\n\n'
+        finally:
+            chunks.close()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
 @api_bp.route('/ai/chat', methods=['POST'])
 def ai_chat():
     """AI chat endpoint for book assistance."""
-    import urllib.request
-    import json as json_lib
-
     data = request.get_json()
     message = data.get('message', '')
     book_id = data.get('book_id', '')
@@ -1359,43 +1753,23 @@ def ai_chat():
     if not message:
         return jsonify({'error': 'الرجاء كتابة رسالة'}), 400
 
+    # Clients asking for text/event-stream get the reply token by token
+    stream = request.accept_mimetypes.best_match(
+        ['application/json', 'text/event-stream']) == 'text/event-stream'
+
     # Get AI settings
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT key, value FROM settings WHERE key IN (?, ?, ?)',
-                   ('claude_api_key', 'ollama_url', 'ai_model'))
-    settings = {row['key']: row['value'] for row in cursor.fetchall()}
-    conn.close()
+    settings = load_settings()
 
     claude_api_key = settings.get('claude_api_key', '').strip()
     ollama_url = settings.get('ollama_url', '').strip()
     ai_model = settings.get('ai_model', 'claude-sonnet-4-5').strip()
 
-    # Model mapping for Ollama (UI name -> actual model name)
-    OLLAMA_MODEL_MAP = {
-        'ollama-llama2': 'llama2:latest',
-        'ollama-llama3': 'llama3.2:latest',
-        'ollama-mistral': 'mistral:latest',
-        'ollama-deepseek': 'deepseek-r1:8b',
-    }
-
-    # Claude model mapping (UI name -> API model name)
-    # Updated to Claude 4.5 family (2025)
-    CLAUDE_MODEL_MAP = {
-        'claude-sonnet-4-5': 'claude-sonnet-4-5-20250929',
-        'claude-opus-4-5': 'claude-opus-4-5-20251101',
-        'claude-haiku-4-5': 'claude-haiku-4-5-20251001',
-    }
-
     # Build context from current page
-    context = f"""أنت مساعد ذكي متخصص في الكتب العربية الإسلامية.
-الكتاب الحالي: {book_title}
-محتوى الصفحة الحالية:
-{page_content[:2000] if page_content else 'لا يوجد محتوى'}
-
-سؤال المستخدم: {message}
-
-أجب باللغة العربية بشكل موجز ومفيد."""
+    context = AI_CONTEXT_TEMPLATE.format(
+        title=book_title,
+        content=page_content[:2000] if page_content else 'لا يوجد محتوى',
+        message=message
+    )
 
     errors = []
 
@@ -1417,23 +1791,23 @@ def ai_chat():
                 'anthropic-version': '2023-06-01'
             }
 
-            payload = json_lib.dumps({
+            payload = {
                 'model': claude_model,
                 'max_tokens': 1024,
                 'messages': [{'role': 'user', 'content': context}]
-            }).encode('utf-8')
+            }
 
-            req = urllib.request.Request(
-                'https://api.anthropic.com/v1/messages',
-                data=payload,
-                headers=headers,
-                method='POST'
-            )
+            if stream:
+                payload['stream'] = True
+                lines = _post_json('https://api.anthropic.com/v1/messages', payload,
+                                   headers, timeout=30, stream=True)
+                return _stream_ai_reply(_claude_reply_text(lines))
 
-            with urllib.request.urlopen(req, timeout=30) as response:
-                result = json_lib.loads(response.read().decode('utf-8'))
-                ai_response = result.get('content', [{}])[0].get('text', '')
-                return jsonify({'response': ai_response})
+            result = _post_json('https://api.anthropic.com/v1/messages', payload,
+                                headers, timeout=30)
+
+            ai_response = result.get('content', [{}])[0].get('text', '')
+            return jsonify({'response': ai_response})
 
         except urllib.error.HTTPError as e:
             error_body = e.read().decode('utf-8') if e.fp else str(e)
@@ -1450,23 +1824,23 @@ def ai_chat():
             # Map UI model name to actual Ollama model name
             ollama_model = OLLAMA_MODEL_MAP.get(ai_model, 'llama2:latest')
 
-            payload = json_lib.dumps({
+            payload = {
                 'model': ollama_model,
                 'prompt': context,
-                'stream': False
-            }).encode('utf-8')
+                'stream': stream
+            }
 
-            req = urllib.request.Request(
-                f'{ollama_url}/api/generate',
-                data=payload,
-                headers={'Content-Type': 'application/json'},
-                method='POST'
-            )
+            if stream:
+                lines = _post_json(f'{ollama_url}/api/generate', payload,
+                                   {'Content-Type': 'application/json'}, timeout=60,
+                                   stream=True)
+                return _stream_ai_reply(_ollama_reply_text(lines))
 
-            with urllib.request.urlopen(req, timeout=60) as response:
-                result = json_lib.loads(response.read().decode('utf-8'))
-                ai_response = result.get('response', '')
-                return jsonify({'response': ai_response})
+            result = _post_json(f'{ollama_url}/api/generate', payload,
+                                {'Content-Type': 'application/json'}, timeout=60)
+
+            ai_response = result.get('response', '')
+            return jsonify({'response': ai_response})
 
         except urllib.error.URLError as e:
             errors.append(f'Ollama connection error: {str(e.reason)}')
@@ -1487,14 +1861,7 @@ def ai_chat():
 @api_bp.route('/ai/debug', methods=['GET'])
 def ai_debug():
     """Debug endpoint to check AI configuration status."""
-    import urllib.request
-
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT key, value FROM settings WHERE key IN (?, ?, ?)',
-                   ('claude_api_key', 'ollama_url', 'ai_model'))
-    settings = {row['key']: row['value'] for row in cursor.fetchall()}
-    conn.close()
+    settings = load_settings()
 
     claude_api_key = settings.get('claude_api_key', '').strip()
     ollama_url = settings.get('ollama_url', '').strip()
@@ -1506,7 +1873,6 @@ def ai_debug():
         try:
             req = urllib.request.Request(f'{ollama_url}/api/tags', method='GET')
             with urllib.request.urlopen(req, timeout=5) as response:
-                import json
                 result = json.loads(response.read().decode('utf-8'))
                 ollama_status['reachable'] = True
                 ollama_status['models'] = [m.get('name') for m in result.get('models', [])]
@@ -1528,48 +1894,48 @@ def ai_debug():
 # DATA MANAGEMENT
 # ============================================================================
 
+def _iter_export_collections(conn):
+    """Collections with their books, grouped from one ordered LEFT JOIN."""
+    # Collections without books still come back (with NULL book columns)
+    cursor = conn.execute('''
+        SELECT c.id, c.name, c.created_at, cb.book_id, cb.position
+        FROM collections c
+        LEFT JOIN collection_books cb ON cb.collection_id = c.id
+        ORDER BY c.id, cb.position
+    ''')
+
+    collection = None
+    for row in cursor:
+        if collection is None or collection['id'] != row['id']:
+            if collection is not None:
+                yield collection
+            collection = {
+                'id': row['id'],
+                'name': row['name'],
+                'created_at': row['created_at'],
+                'books': []
+            }
+        if row['book_id'] is not None:
+            collection['books'].append({'book_id': row['book_id'], 'position': row['position']})
+
+    if collection is not None:
+        yield collection
+
+
 @api_bp.route('/data/export')
 def export_data():
     """Export all user data as JSON backup."""
-    import json
-    from datetime import datetime
-
     conn = get_db()
-    cursor = conn.cursor()
 
-    export_data = {
-        'export_date': datetime.now().isoformat(),
-        'version': '2.0',
-        'collections': [],
-        'reading_progress': [],
-        'settings': {},
-        'search_history': [],
-        'custom_categories': [],
-        'book_ownership': []
+    # Settings (except sensitive ones like API keys) are a handful of rows
+    settings = {
+        row['key']: row['value']
+        for row in conn.execute('SELECT key, value FROM settings')
+        if row['key'] not in ('claude_api_key',)
     }
 
-    # Export collections
-    cursor.execute('SELECT * FROM collections')
-    for coll in cursor.fetchall():
-        collection_data = {
-            'id': coll['id'],
-            'name': coll['name'],
-            'created_at': coll['created_at'],
-            'books': []
-        }
-        cursor.execute('''
-            SELECT book_id, position FROM collection_books
-            WHERE collection_id = ? ORDER BY position
-        ''', (coll['id'],))
-        collection_data['books'] = [
-            {'book_id': row['book_id'], 'position': row['position']}
-            for row in cursor.fetchall()
-        ]
-        export_data['collections'].append(collection_data)
-
-    # Export reading progress
-    cursor.execute('SELECT * FROM reading_progress')
-    export_data['reading_progress'] = [
+    # Every other section is streamed straight off its cursor
+    reading_progress = (
         {
             'book_id': row['book_id'],
             'current_page': row['current_page'],
@@ -1577,40 +1943,34 @@ def export_data():
             'last_read': row['last_read'],
             'is_complete': bool(row['is_complete'])
         }
-        for row in cursor.fetchall()
-    ]
-
-    # Export settings (except sensitive ones)
-    cursor.execute('SELECT key, value FROM settings')
-    for row in cursor.fetchall():
-        # Don't export sensitive data like API keys
-        if row['key'] not in ('claude_api_key',):
-            export_data['settings'][row['key']] = row['value']
-
-    # Export search history
-    cursor.execute('SELECT query, searched_at FROM search_history ORDER BY searched_at DESC LIMIT 100')
-    export_data['search_history'] = [
+        for row in conn.execute('SELECT * FROM reading_progress')
+    )
+    search_history = (
         {'query': row['query'], 'searched_at': row['searched_at']}
-        for row in cursor.fetchall()
-    ]
-
-    # Export custom categories
-    cursor.execute('SELECT * FROM custom_categories')
-    export_data['custom_categories'] = [
+        for row in conn.execute(
+            'SELECT query, searched_at FROM search_history ORDER BY searched_at DESC LIMIT 100')
+    )
+    custom_categories = (
         {'id': row['id'], 'name': row['name'], 'created_at': row['created_at']}
-        for row in cursor.fetchall()
-    ]
-
-    # Export book ownership status
-    cursor.execute('SELECT id, is_owned FROM books WHERE is_owned = 1')
-    export_data['book_ownership'] = [
+        for row in conn.execute('SELECT * FROM custom_categories')
+    )
+    book_ownership = (
         {'book_id': row['id'], 'is_owned': True}
-        for row in cursor.fetchall()
-    ]
+        for row in conn.execute('SELECT id, is_owned FROM books WHERE is_owned = 1')
+    )
 
-    conn.close()
+    export_data = _iter_json_object([
+        ('export_date', datetime.now().isoformat()),
+        ('version', '2.0'),
+        ('collections', _iter_export_collections(conn)),
+        ('reading_progress', reading_progress),
+        ('settings', settings),
+        ('search_history', search_history),
+        ('custom_categories', custom_categories),
+        ('book_ownership', book_ownership)
+    ])
 
-    return jsonify(export_data)
+    return Response(stream_with_context(export_data), mimetype='application/json')
 
 
 @api_bp.route('/data/import', methods=['POST'])
@@ -1625,7 +1985,12 @@ def import_data():
     cursor = conn.cursor()
 
     try:
-        # Import collections
+        # One write transaction for the whole backup; each section below
+        # goes in with a single executemany
+        cursor.execute('BEGIN IMMEDIATE')
+
+        # Import collections (one at a time: a collection without an id
+        # needs the rowid it was given for its books)
         if 'collections' in data:
             for coll in data['collections']:
                 cursor.execute('''
@@ -1637,52 +2002,48 @@ def import_data():
 
                 # Import collection books
                 if 'books' in coll:
-                    for book in coll['books']:
-                        cursor.execute('''
-                            INSERT OR IGNORE INTO collection_books (collection_id, book_id, position)
-                            VALUES (?, ?, ?)
-                        ''', (coll_id, book['book_id'], book.get('position', 0)))
+                    cursor.executemany('''
+                        INSERT OR IGNORE INTO collection_books (collection_id, book_id, position)
+                        VALUES (?, ?, ?)
+                    ''', [(coll_id, book['book_id'], book.get('position', 0))
+                          for book in coll['books']])
 
         # Import reading progress
         if 'reading_progress' in data:
-            for progress in data['reading_progress']:
-                cursor.execute('''
-                    INSERT OR REPLACE INTO reading_progress
-                    (book_id, current_page, total_pages, last_read, is_complete)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    progress['book_id'],
-                    progress.get('current_page', 1),
-                    progress.get('total_pages', 1),
-                    progress.get('last_read'),
-                    1 if progress.get('is_complete') else 0
-                ))
+            cursor.executemany('''
+                INSERT OR REPLACE INTO reading_progress
+                (book_id, current_page, total_pages, last_read, is_complete)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(
+                progress['book_id'],
+                progress.get('current_page', 1),
+                progress.get('total_pages', 1),
+                progress.get('last_read'),
+                1 if progress.get('is_complete') else 0
+            ) for progress in data['reading_progress']])
 
         # Import settings (except sensitive ones)
         if 'settings' in data:
-            for key, value in data['settings'].items():
-                if key not in ('claude_api_key',):  # Skip sensitive settings
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)
-                    ''', (key, value))
+            cursor.executemany('''
+                INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)
+            ''', [(key, value) for key, value in data['settings'].items()
+                  if key not in ('claude_api_key',)])  # Skip sensitive settings
 
         # Import custom categories
         if 'custom_categories' in data:
-            for cat in data['custom_categories']:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO custom_categories (id, name, created_at)
-                    VALUES (?, ?, ?)
-                ''', (cat.get('id'), cat['name'], cat.get('created_at')))
+            cursor.executemany('''
+                INSERT OR IGNORE INTO custom_categories (id, name, created_at)
+                VALUES (?, ?, ?)
+            ''', [(cat.get('id'), cat['name'], cat.get('created_at'))
+                  for cat in data['custom_categories']])
 
         # Import book ownership
         if 'book_ownership' in data:
-            for ownership in data['book_ownership']:
-                cursor.execute('''
-                    UPDATE books SET is_owned = 1 WHERE id = ?
-                ''', (ownership['book_id'],))
+            cursor.executemany('''
+                UPDATE books SET is_owned = 1 WHERE id = ?
+            ''', [(ownership['book_id'],) for ownership in data['book_ownership']])
 
         conn.commit()
-        conn.close()
 
         return jsonify({
             'status': 'success',
@@ -1691,7 +2052,6 @@ def import_data():
 
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({
             'status': 'error',
             'message': f'فشل استيراد البيانات: {str(e)}'
@@ -1702,6 +2062,13 @@ def import_data():
 # NOTES / NOTEBOOK
 # ============================================================================
 
+def _note_excerpt(content):
+    """First NOTE_EXCERPT_CHARS characters of a note, with '...' if cut."""
+    if len(content) > NOTE_EXCERPT_CHARS:
+        return content[:NOTE_EXCERPT_CHARS] + '...'
+    return content
+
+
 @api_bp.route('/notes')
 def get_notes():
     """Get all notes, grouped by date."""
@@ -1715,26 +2082,23 @@ def get_notes():
     ''')
 
     notes = []
-    for row in cursor.fetchall():
+    for row in cursor:
         notes.append({
             'id': row['id'],
             'content': row['content'],
-            'excerpt': row['content'][:80] + '...' if len(row['content']) > 80 else row['content'],
+            'excerpt': _note_excerpt(row['content']),
             'created_at': row['created_at'],
             'updated_at': row['updated_at'],
             'source_type': row['source_type'],
             'source_ref': row['source_ref']
         })
 
-    conn.close()
     return jsonify({'notes': notes})
 
 
 @api_bp.route('/notes', methods=['POST'])
 def create_note():
     """Create a new note."""
-    import json as json_lib
-
     data = request.get_json()
     content = data.get('content', '')  # Allow empty content for new notes
     source_type = data.get('source_type', 'manual')
@@ -1742,31 +2106,27 @@ def create_note():
 
     # Serialize source_ref to JSON if it's a dict
     if source_ref and isinstance(source_ref, dict):
-        source_ref = json_lib.dumps(source_ref, ensure_ascii=False)
+        source_ref = json.dumps(source_ref, ensure_ascii=False)
 
     conn = get_db()
     cursor = conn.cursor()
 
+    # RETURNING hands back the defaulted id and timestamps in the same statement
     cursor.execute('''
         INSERT INTO notes (content, source_type, source_ref)
         VALUES (?, ?, ?)
+        RETURNING id, content, created_at, updated_at, source_type, source_ref
     ''', (content, source_type, source_ref))
-
-    note_id = cursor.lastrowid
-
-    # Get the created note
-    cursor.execute('SELECT * FROM notes WHERE id = ?', (note_id,))
     row = cursor.fetchone()
 
     conn.commit()
-    conn.close()
 
     return jsonify({
         'status': 'success',
         'note': {
             'id': row['id'],
             'content': row['content'],
-            'excerpt': row['content'][:80] + '...' if len(row['content']) > 80 else row['content'],
+            'excerpt': _note_excerpt(row['content']),
             'created_at': row['created_at'],
             'updated_at': row['updated_at'],
             'source_type': row['source_type'],
@@ -1783,7 +2143,6 @@ def get_note(note_id):
 
     cursor.execute('SELECT * FROM notes WHERE id = ?', (note_id,))
     row = cursor.fetchone()
-    conn.close()
 
     if not row:
         return jsonify({'error': 'الملاحظة غير موجودة'}), 404
@@ -1810,19 +2169,16 @@ def update_note(note_id):
     conn = get_db()
     cursor = conn.cursor()
 
-    # Check if note exists
-    cursor.execute('SELECT id FROM notes WHERE id = ?', (note_id,))
-    if not cursor.fetchone():
-        conn.close()
-        return jsonify({'error': 'الملاحظة غير موجودة'}), 404
-
     cursor.execute('''
         UPDATE notes SET content = ?, updated_at = CURRENT_TIMESTAMP
         WHERE id = ?
     ''', (content, note_id))
+    updated = cursor.rowcount > 0
 
     conn.commit()
-    conn.close()
+
+    if not updated:
+        return jsonify({'error': 'الملاحظة غير موجودة'}), 404
 
     return jsonify({'status': 'success'})
 
@@ -1837,7 +2193,6 @@ def delete_note(note_id):
     deleted = cursor.rowcount > 0
 
     conn.commit()
-    conn.close()
 
     if not deleted:
         return jsonify({'error': 'الملاحظة غير موجودة'}), 404
@@ -1845,13 +2200,15 @@ def delete_note(note_id):
     return jsonify({'status': 'success'})
 
 
+def _write_text_file(path, text):
+    """Write text to path as UTF-8, replacing any existing file."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
 @api_bp.route('/notes/export', methods=['POST'])
 def export_notes():
     """Export selected notes as Markdown files."""
-    import os
-    import re
-    import json as json_lib
-    from datetime import datetime
 
     data = request.get_json()
     note_ids = data.get('note_ids', [])
@@ -1870,15 +2227,15 @@ def export_notes():
     conn = get_db()
     cursor = conn.cursor()
 
-    # Get selected notes
-    placeholders = ','.join('?' * len(note_ids))
-    cursor.execute(f'SELECT * FROM notes WHERE id IN ({placeholders})', note_ids)
-
-    notes = cursor.fetchall()
-    conn.close()
+    # Get selected notes; the ids go in as one JSON array parameter, so
+    # the statement is the same (and cached) however many are selected
+    cursor.execute('''
+        SELECT * FROM notes WHERE id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(note_ids),))
 
     exported = []
-    for note in notes:
+    files = {}
+    for note in cursor:
         # Generate filename
         try:
             created = datetime.fromisoformat(note['created_at'].replace('Z', '+00:00')) if note['created_at'] else datetime.now()
@@ -1888,8 +2245,8 @@ def export_notes():
 
         # Create slug from first 30 chars of content
         content = note['content'] or ''
-        content_slug = re.sub(r'[^\w\s\u0600-\u06FF]', '', content[:30])
-        content_slug = re.sub(r'\s+', '-', content_slug.strip()) or f"note-{note['id']}"
+        content_slug = _SLUG_STRIP_RE.sub('', content[:30])
+        content_slug = _SLUG_SPACES_RE.sub('-', content_slug.strip()) or f"note-{note['id']}"
 
         filename = f"{timestamp}_{content_slug}.md"
         filepath = os.path.join(folder_path, filename)
@@ -1905,7 +2262,7 @@ def export_notes():
                 frontmatter.append(f"source_type: {note['source_type']}")
             if note['source_ref']:
                 try:
-                    ref = json_lib.loads(note['source_ref'])
+                    ref = json.loads(note['source_ref'])
                     if ref.get('book_title'):
                         frontmatter.append(f"book: \"{ref['book_title']}\"")
                     if ref.get('author'):
@@ -1921,12 +2278,15 @@ def export_notes():
         # Add note content
         file_content += content
 
-        # Write file
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(file_content)
+        # Queue the file; a repeated name keeps the last note, as before
+        files[filepath] = file_content
 
         exported.append({'id': note['id'], 'filename': filename})
 
+    # Write the files concurrently; list() re-raises the first failure
+    with ThreadPoolExecutor(max_workers=NOTE_EXPORT_WRITERS) as pool:
+        list(pool.map(_write_text_file, files.keys(), files.values()))
+
     return jsonify({
         'status': 'success',
         'exported': len(exported),
@@ -1938,18 +2298,7 @@ def export_notes():
 def browse_export_folder():
     """Open native folder picker for export destination."""
     try:
-        import tkinter as tk
-        from tkinter import filedialog
-
-        root = tk.Tk()
-        root.withdraw()
-        root.attributes('-topmost', True)
-
-        folder_path = filedialog.askdirectory(
-            title='اختر مجلد التصدير'
-        )
-
-        root.destroy()
+        folder_path = pick_path('folder', title='اختر مجلد التصدير')
 
         if folder_path:
             return jsonify({'status': 'success', 'path': folder_path})
@@ -1963,44 +2312,22 @@ def browse_export_folder():
 @api_bp.route('/data/stats')
 def get_data_stats():
     """Get database statistics and size information."""
-    import os
-
     conn = get_db()
     cursor = conn.cursor()
 
-    stats = {}
-
-    # Count books
-    cursor.execute('SELECT COUNT(*) as count FROM books')
-    stats['total_books'] = cursor.fetchone()['count']
-
-    cursor.execute('SELECT COUNT(*) as count FROM books WHERE is_downloaded = 1')
-    stats['downloaded_books'] = cursor.fetchone()['count']
-
-    cursor.execute('SELECT COUNT(*) as count FROM books WHERE is_owned = 1')
-    stats['owned_books'] = cursor.fetchone()['count']
-
-    # Count pages
-    cursor.execute('SELECT COUNT(*) as count FROM pages')
-    stats['total_pages'] = cursor.fetchone()['count']
-
-    # Count authors
-    cursor.execute('SELECT COUNT(*) as count FROM authors')
-    stats['total_authors'] = cursor.fetchone()['count']
-
-    # Count collections
-    cursor.execute('SELECT COUNT(*) as count FROM collections')
-    stats['total_collections'] = cursor.fetchone()['count']
-
-    # Count search history
-    cursor.execute('SELECT COUNT(*) as count FROM search_history')
-    stats['search_history_count'] = cursor.fetchone()['count']
-
-    # Reading progress stats
-    cursor.execute('SELECT COUNT(*) as count FROM reading_progress WHERE is_complete = 1')
-    stats['completed_books'] = cursor.fetchone()['count']
-
-    conn.close()
+    # All counts in one statement; the three book counts share one scan
+    cursor.execute('''
+        SELECT COUNT(*) AS total_books,
+               COALESCE(SUM(is_downloaded = 1), 0) AS downloaded_books,
+               COALESCE(SUM(is_owned = 1), 0) AS owned_books,
+               (SELECT COUNT(*) FROM pages) AS total_pages,
+               (SELECT COUNT(*) FROM authors) AS total_authors,
+               (SELECT COUNT(*) FROM collections) AS total_collections,
+               (SELECT COUNT(*) FROM search_history) AS search_history_count,
+               (SELECT COUNT(*) FROM reading_progress WHERE is_complete = 1) AS completed_books
+        FROM books
+    ''')
+    stats = dict(cursor.fetchone())
 
     # Database file size
     db_path = current_app.config['DATABASE_PATH']
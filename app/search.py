@@ -6,6 +6,27 @@ import re
 import sqlite3
 from typing import List, Dict, Any, Optional
 
+from app.models import BUSY_TIMEOUT_MS, get_thread_connection
+
+
+# Arabic diacritics (tashkeel), U+064B to U+065F, plus superscript alef
+_TASHKEEL_RE = re.compile(r'[\u064B-\u065F\u0670]')
+
+# Letter folds applied after the diacritics are stripped. FTS5's unicode61
+# tokenizer cannot do these itself: remove_diacritics only folds Latin
+# letters, and it treats Arabic combining marks as token separators.
+_ARABIC_FOLDS = (
+    ('\u0640', ''),        # Remove tatweel (kashida)
+    ('\u0623', '\u0627'),  # أ → ا (alef with hamza above)
+    ('\u0625', '\u0627'),  # إ → ا (alef with hamza below)
+    ('\u0622', '\u0627'),  # آ → ا (alef with madda)
+    ('\u0671', '\u0627'),  # ٱ → ا (alef wasla)
+    ('\u0649', '\u064A'),  # ى → ي (alef maqsura to ya)
+    ('\u0629', '\u0647'),  # ة → ه (ta marbuta to ha, for search matching)
+    ('\u0624', '\u0648'),  # ؤ → و (waw with hamza)
+    ('\u0626', '\u064A'),  # ئ → ي (ya with hamza)
+)
+
 
 def normalize_arabic(text: str) -> str:
     """
@@ -21,57 +42,64 @@ def normalize_arabic(text: str) -> str:
     if not text:
         return ''
 
-    # Remove tashkeel (Arabic diacritics)
-    # Unicode range for Arabic diacritics: U+064B to U+065F
-    tashkeel_pattern = re.compile(r'[\u064B-\u065F\u0670]')
-    text = tashkeel_pattern.sub('', text)
-
-    # Remove tatweel (kashida)
-    text = text.replace('\u0640', '')
-
-    # Normalize alef variants to bare alef
-    alef_variants = {
-        '\u0623': '\u0627',  # أ → ا (alef with hamza above)
-        '\u0625': '\u0627',  # إ → ا (alef with hamza below)
-        '\u0622': '\u0627',  # آ → ا (alef with madda)
-        '\u0671': '\u0627',  # ٱ → ا (alef wasla)
-    }
-    for variant, replacement in alef_variants.items():
+    # Nothing below touches ASCII, and isascii() is a flag check, not a scan
+    if text.isascii():
+        return text
+
+    text = _TASHKEEL_RE.sub('', text)
+    for variant, replacement in _ARABIC_FOLDS:
         text = text.replace(variant, replacement)
 
-    # Normalize alef maqsura to ya
-    text = text.replace('\u0649', '\u064A')  # ى → ي
+    return text
 
-    # Normalize ta marbuta to ha (for search matching)
-    text = text.replace('\u0629', '\u0647')  # ة → ه
 
-    # Normalize hamza variants
-    hamza_variants = {
-        '\u0624': '\u0648',  # ؤ → و (waw with hamza)
-        '\u0626': '\u064A',  # ئ → ي (ya with hamza)
-    }
-    for variant, replacement in hamza_variants.items():
-        text = text.replace(variant, replacement)
+# Characters normalize_arabic deletes, and for each letter it folds into,
+# the original letters that fold into it. Together they let a normalized
+# query be matched against the original text directly.
+_HIGHLIGHT_SKIP = '[\u064B-\u065F\u0670\u0640]*'
+_FOLD_SOURCES = {
+    replacement: replacement + ''.join(v for v, r in _ARABIC_FOLDS if r == replacement)
+    for _, replacement in _ARABIC_FOLDS if replacement
+}
 
-    return text
 
+def highlight_pattern(query: str) -> Optional[re.Pattern]:
+    """
+    Compile a pattern that finds query in un-normalized text.
+
+    Each letter also accepts the letters normalize_arabic folds into it,
+    and any diacritics or tatweel may sit between and after the letters,
+    so the match spans exactly the original characters. Returns None if
+    nothing is left of the query after normalization.
+    """
+    query_normalized = normalize_arabic(query.lower())
+    if not query_normalized:
+        return None
+
+    parts = []
+    for ch in query_normalized:
+        sources = _FOLD_SOURCES.get(ch)
+        parts.append(f'[{sources}]' if sources else re.escape(ch))
+    return re.compile(_HIGHLIGHT_SKIP.join(parts) + _HIGHLIGHT_SKIP, re.IGNORECASE)
 
-def highlight_matches(text: str, query: str, max_length: int = 200) -> str:
+
+def highlight_matches(text: str, query: str, max_length: int = 200,
+                      pattern: Optional[re.Pattern] = None) -> str:
     """
     Highlight search matches in text with <mark> tags.
     Returns a snippet around the first match.
+
+    Callers highlighting many texts for one query can pass the query's
+    highlight_pattern() so it is compiled only once.
     """
     if not text or not query:
         return text[:max_length] if text else ''
 
-    # Normalize both for matching
-    text_normalized = normalize_arabic(text.lower())
-    query_normalized = normalize_arabic(query.lower())
-
-    # Find the position of the match in normalized text
-    match_pos = text_normalized.find(query_normalized)
+    if pattern is None:
+        pattern = highlight_pattern(query)
+    match = pattern.search(text) if pattern else None
 
-    if match_pos == -1:
+    if match is None:
         # No match found, return beginning of text
         return text[:max_length] + ('...' if len(text) > max_length else '')
 
@@ -79,10 +107,17 @@ def highlight_matches(text: str, query: str, max_length: int = 200) -> str:
     context_before = 50
     context_after = 100
 
-    start = max(0, match_pos - context_before)
-    end = min(len(text), match_pos + len(query) + context_after)
+    match_start, match_end = match.span()
+    start = max(0, match_start - context_before)
+    end = min(len(text), match_end + context_after)
 
-    snippet = text[start:end]
+    snippet = (
+        text[start:match_start] +
+        '<mark>' +
+        text[match_start:match_end] +
+        '</mark>' +
+        text[match_end:end]
+    )
 
     # Add ellipsis if truncated
     if start > 0:
@@ -90,31 +125,15 @@ def highlight_matches(text: str, query: str, max_length: int = 200) -> str:
     if end < len(text):
         snippet = snippet + '...'
 
-    # Now highlight the actual query in the snippet
-    # We need to find where the query appears in the original text
-    # Use case-insensitive search on normalized text
-    snippet_normalized = normalize_arabic(snippet.lower())
-    query_pos_in_snippet = snippet_normalized.find(query_normalized)
-
-    if query_pos_in_snippet != -1:
-        # Find the actual text at this position (may have diacritics)
-        # We need to highlight the corresponding original characters
-        original_start = query_pos_in_snippet
-
-        # Count how many characters in original text correspond to normalized position
-        # This is approximate but works for most cases
-        highlighted = (
-            snippet[:original_start] +
-            '<mark>' +
-            snippet[original_start:original_start + len(query) + 5] +  # +5 for potential diacritics
-            '</mark>' +
-            snippet[original_start + len(query) + 5:]
-        )
-        return highlighted
-
     return snippet
 
 
+# How long a search waits for the write lock to record its history entry.
+# Reads never wait on writers under WAL, but this insert does; during a
+# book upload the entry is skipped rather than stalling the search.
+HISTORY_BUSY_TIMEOUT_MS = 100
+
+
 class SearchEngine:
     """FTS5-based search engine for Arabic text."""
 
@@ -122,12 +141,8 @@ class SearchEngine:
         self.db_path = db_path
 
     def _get_connection(self):
-        """Get database connection with timeout for concurrency."""
-        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        conn.execute('PRAGMA journal_mode=WAL')
-        conn.execute('PRAGMA busy_timeout=30000')
-        return conn
+        """Get this thread's shared connection (warm page cache, never closed)."""
+        return get_thread_connection(self.db_path)
 
     def index_page(self, book_id: str, page_num: int, content: str):
         """Index a single page in FTS5."""
@@ -136,48 +151,30 @@ class SearchEngine:
         conn = self._get_connection()
         cursor = conn.cursor()
 
-        # Update the pages table
+        # Update the pages table; the pages_fts triggers update the index
         cursor.execute('''
             INSERT OR REPLACE INTO pages (book_id, page_num, content, content_normalized)
             VALUES (?, ?, ?, ?)
         ''', (book_id, page_num, content, normalized_content))
 
-        # Update FTS5 index
-        cursor.execute('''
-            INSERT INTO pages_fts (book_id, page_num, content)
-            VALUES (?, ?, ?)
-        ''', (book_id, str(page_num), normalized_content))
-
         conn.commit()
-        conn.close()
 
     def index_book(self, book_id: str, pages: List[Dict[str, Any]]):
         """Index all pages of a book in FTS5."""
         conn = self._get_connection()
         cursor = conn.cursor()
 
-        # Clear existing index for this book
-        cursor.execute('DELETE FROM pages_fts WHERE book_id = ?', (book_id,))
+        # Clear existing pages (and, through the triggers, their index entries)
         cursor.execute('DELETE FROM pages WHERE book_id = ?', (book_id,))
 
-        # Insert all pages
-        for page in pages:
-            page_num = page['page_num']
-            content = page['content']
-            normalized_content = normalize_arabic(content)
-
-            cursor.execute('''
-                INSERT INTO pages (book_id, page_num, content, content_normalized)
-                VALUES (?, ?, ?, ?)
-            ''', (book_id, page_num, content, normalized_content))
-
-            cursor.execute('''
-                INSERT INTO pages_fts (book_id, page_num, content)
-                VALUES (?, ?, ?)
-            ''', (book_id, str(page_num), normalized_content))
+        # Insert all pages in one statement; the triggers index each row
+        cursor.executemany('''
+            INSERT INTO pages (book_id, page_num, content, content_normalized)
+            VALUES (?, ?, ?, ?)
+        ''', ((book_id, page['page_num'], page['content'], normalize_arabic(page['content']))
+              for page in pages))
 
         conn.commit()
-        conn.close()
 
     def search(
         self,
@@ -229,7 +226,12 @@ class SearchEngine:
         # Build FTS5 query based on precision mode
         fts_query = self._build_fts_query(normalized_query, precision)
 
-        # Base query with FTS5 search
+        # Base query with FTS5 search. The join order and the primary key
+        # lookups are pinned: the planner otherwise trusts sqlite_stat1,
+        # which this thread's connection loaded once and which says "two
+        # books" on a library analyzed right after the bundled import, and
+        # under a book/author/category filter it then rescans books (and
+        # authors) for every matching page.
         sql = '''
             SELECT
                 p.id,
@@ -242,34 +244,55 @@ class SearchEngine:
                 c.name as category_name,
                 bm25(pages_fts) as rank
             FROM pages_fts
-            JOIN pages p ON pages_fts.book_id = p.book_id AND CAST(pages_fts.page_num AS INTEGER) = p.page_num
-            JOIN books b ON p.book_id = b.id
-            LEFT JOIN authors a ON b.author_id = a.id
+            CROSS JOIN pages p ON p.id = pages_fts.rowid
+            CROSS JOIN books b INDEXED BY sqlite_autoindex_books_1 ON p.book_id = b.id
+            LEFT JOIN authors a INDEXED BY sqlite_autoindex_authors_1 ON b.author_id = a.id
             LEFT JOIN categories c ON b.category_id = c.id
             WHERE pages_fts MATCH ?
         '''
 
-        params = [f'"{fts_query}"']
+        # The total only depends on which pages match: the author and
+        # category LEFT JOINs are on unique keys, and every page belongs to
+        # a book, so an unfiltered count never has to leave the FTS index
+        # and a filtered one reads the filter columns from a covering index
+        count_sql = '''
+            SELECT COUNT(*)
+            FROM pages_fts
+            WHERE pages_fts MATCH ?
+        '''
+        if book_ids or author_ids or category_ids:
+            count_sql = '''
+                SELECT COUNT(*)
+                FROM pages_fts
+                CROSS JOIN pages p ON p.id = pages_fts.rowid
+                CROSS JOIN books b INDEXED BY idx_books_search_filters ON p.book_id = b.id
+                WHERE pages_fts MATCH ?
+            '''
+
+        # _build_fts_query already quotes each term or the whole phrase
+        params = [fts_query]
 
         # Add filters
+        filters = ''
         if book_ids:
             placeholders = ','.join('?' * len(book_ids))
-            sql += f' AND p.book_id IN ({placeholders})'
+            filters += f' AND p.book_id IN ({placeholders})'
             params.extend(book_ids)
 
         if author_ids:
             placeholders = ','.join('?' * len(author_ids))
-            sql += f' AND b.author_id IN ({placeholders})'
+            filters += f' AND b.author_id IN ({placeholders})'
             params.extend(author_ids)
 
         if category_ids:
             placeholders = ','.join('?' * len(category_ids))
-            sql += f' AND b.category_id IN ({placeholders})'
+            filters += f' AND b.category_id IN ({placeholders})'
             params.extend(category_ids)
 
+        sql += filters
+
         # Get total count
-        count_sql = f'SELECT COUNT(*) FROM ({sql})'
-        cursor.execute(count_sql, params)
+        cursor.execute(count_sql + filters, params)
         total = cursor.fetchone()[0]
 
         # Add ordering and pagination
@@ -283,9 +306,11 @@ class SearchEngine:
         # Format results
         results = []
         snippet_length = 400 if full_result else 200
+        query_pattern = highlight_pattern(query) if highlight else None
         for row in rows:
             if highlight:
-                snippet = highlight_matches(row['content'], query, max_length=snippet_length)
+                snippet = highlight_matches(row['content'], query, max_length=snippet_length,
+                                            pattern=query_pattern)
             else:
                 # No highlighting, just truncate
                 content = row['content']
@@ -305,8 +330,6 @@ class SearchEngine:
         # Save to search history
         self._save_search_history(query, total)
 
-        conn.close()
-
         total_pages = (total + limit - 1) // limit
 
         return {
@@ -352,25 +375,33 @@ class SearchEngine:
             return ' '.join(f'"{w}"' for w in words)
 
     def _save_search_history(self, query: str, results_count: int):
-        """Save search query to history."""
+        """Save search query to history (best effort while another write is running)."""
         conn = self._get_connection()
+        conn.execute(f'PRAGMA busy_timeout={HISTORY_BUSY_TIMEOUT_MS}')
         cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO search_history (query, results_count)
-            VALUES (?, ?)
-        ''', (query, results_count))
-
-        # Keep only last 50 searches
-        cursor.execute('''
-            DELETE FROM search_history
-            WHERE id NOT IN (
-                SELECT id FROM search_history ORDER BY searched_at DESC LIMIT 50
-            )
-        ''')
+        try:
+            cursor.execute('''
+                INSERT INTO search_history (query, results_count)
+                VALUES (?, ?)
+            ''', (query, results_count))
 
-        conn.commit()
-        conn.close()
+            # Keep only last 50 searches. Rows are only ever added here, so
+            # the AUTOINCREMENT id follows searched_at and the cutoff is a
+            # rowid lookup instead of sorting the table on every search
+            cursor.execute('''
+                DELETE FROM search_history
+                WHERE id <= (
+                    SELECT id FROM search_history ORDER BY id DESC LIMIT 1 OFFSET 50
+                )
+            ''')
+
+            conn.commit()
+        except sqlite3.OperationalError:
+            # Write lock held (e.g. by a book upload); skip this entry
+            conn.rollback()
+        finally:
+            conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
 
     def get_search_history(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Get recent search history."""
@@ -386,7 +417,6 @@ class SearchEngine:
         ''', (limit,))
 
         rows = cursor.fetchall()
-        conn.close()
 
         return [{'id': i, 'query': row['query']} for i, row in enumerate(rows, 1)]
 
@@ -395,16 +425,9 @@ class SearchEngine:
         conn = self._get_connection()
         cursor = conn.cursor()
 
-        # Clear existing FTS index
-        cursor.execute('DELETE FROM pages_fts')
-
-        # Repopulate from pages table
-        cursor.execute('''
-            INSERT INTO pages_fts (book_id, page_num, content)
-            SELECT book_id, CAST(page_num AS TEXT), content_normalized
-            FROM pages
-            WHERE content_normalized IS NOT NULL
-        ''')
+        # Re-read every row of the external content table (pages), then
+        # merge the freshly written segments into one b-tree for querying
+        cursor.execute("INSERT INTO pages_fts (pages_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO pages_fts (pages_fts) VALUES ('optimize')")
 
         conn.commit()
-        conn.close()
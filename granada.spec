@@ -44,6 +44,8 @@ hidden_imports = [
     'werkzeug',
     'werkzeug.routing',
     'werkzeug.utils',
+    'waitress',
+    'orjson',
     'sqlite3',
     'json',
     'urllib.request',